@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""Parse time and allocations of Gerrit change payloads
+
+Compares full ChangeInfo validation with projection (LazyChange) mode
+for a change with many revisions, messages and reviewers, and parsing
+of a large mergelist.
+
+    python benchmarks/bench_gerrit_parse.py [--revisions N] [--mergelist N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault(
+    "SKYLLA_CONFIG",
+    os.path.join(os.path.dirname(__file__), "..", "tests", "skylla-test.conf"),
+)
+
+import pydantic  # noqa: E402
+
+# test configuration uses https+mock:// URLs
+pydantic.HttpUrl = pydantic.AnyUrl  # type: ignore
+
+DATE = "2020-07-01 10:00:00.000000000"
+
+
+def account(num):
+    return {
+        "_account_id": 1000 + num,
+        "name": f"User {num}",
+        "email": f"user{num}@pekao.com.pl",
+        "username": f"user{num}",
+        "avatars": [{"url": f"https://gerrit/avatar/{num}", "height": 32}],
+    }
+
+
+def commit(sha, message, parents=1):
+    person = {"name": "Jan", "email": "jan@pekao.com.pl", "date": DATE, "tz": 60}
+    return {
+        "commit": sha,
+        "parents": [{"commit": f"{sha}{n}", "subject": "p"} for n in range(parents)],
+        "author": person,
+        "committer": person,
+        "subject": message.splitlines()[0],
+        "message": message,
+        "web_links": [{"name": "browse", "url": f"/plugins/gitiles/+/{sha}"}],
+    }
+
+
+def change_payload(revisions):
+    revs = {}
+    for num in range(1, revisions + 1):
+        sha = f"{num:040x}"
+        revs[sha] = {
+            "kind": "REWORK",
+            "_number": num,
+            "created": DATE,
+            "uploader": account(num % 5),
+            "ref": f"refs/changes/34/1234/{num}",
+            "fetch": {
+                "http": {
+                    "url": "https://gerrit/infra/skylla",
+                    "ref": f"refs/changes/34/1234/{num}",
+                    "commands": {"Checkout": "git fetch && git checkout FETCH_HEAD"},
+                }
+            },
+            "commit": commit(sha, f"REL-{num} zmiana\n\nopis zmiany {num}\n", 2),
+        }
+    return {
+        "id": "infra%2Fskylla~develop~I0123",
+        "project": "infra/skylla",
+        "branch": "develop",
+        "change_id": "I0123",
+        "subject": "REL-1 zmiana",
+        "status": "MERGED",
+        "created": DATE,
+        "updated": DATE,
+        "insertions": 10,
+        "deletions": 2,
+        "_number": 1234,
+        "owner": account(0),
+        "labels": {
+            "Code-Review": {
+                "all": [
+                    {"value": "2", "date": DATE, "_account_id": n} for n in range(10)
+                ],
+                "values": ["-2", "-1", " 0", "+1", "+2"],
+            }
+        },
+        "reviewers": {"REVIEWER": [account(n) for n in range(10)]},
+        "messages": [
+            {"id": f"m{n}", "author": account(n % 5), "date": DATE, "message": "ok"}
+            for n in range(revisions * 2)
+        ],
+        "current_revision": f"{revisions:040x}",
+        "revisions": revs,
+    }
+
+
+def measure(name, func, number):
+    seconds = timeit.timeit(func, number=number) / number
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<28} {seconds * 1e3:8.3f} ms  peak {peak / 1024:8.1f} KiB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--revisions", type=int, default=30)
+    parser.add_argument("--mergelist", type=int, default=500)
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args()
+
+    from skylla.models.gerrit import ChangeInfo, CommitInfo, LazyChange
+
+    raw_change = json.dumps(change_payload(args.revisions)).encode()
+    raw_mergelist = json.dumps(
+        [commit(f"{n:040x}", f"REL-{n} zmiana\n") for n in range(args.mergelist)]
+    ).encode()
+    print(f"change {len(raw_change)} B, mergelist {len(raw_mergelist)} B")
+    number = args.number
+
+    measure("ChangeInfo.parse_raw", lambda: ChangeInfo.parse_raw(raw_change), number)
+    measure("LazyChange.parse_raw", lambda: LazyChange.parse_raw(raw_change), number)
+    measure(
+        "mergelist CommitInfo",
+        lambda: [CommitInfo.parse_obj(c) for c in json.loads(raw_mergelist)],
+        number,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""Jira issue key extraction from commit messages of a large mergelist
+
+Compares per-message regex (compiled on every call, as before
+IssueKeyExtractor) with single pass over all messages, with and without
+filtering by known Jira project keys.
+
+    python benchmarks/bench_issue_keys.py [--mergelist N] [--number N]
+"""
+
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from skylla.lib.issuekeys import IssueKeyExtractor  # noqa: E402
+
+
+def message(num):
+    return (
+        f"REL-{num % 300} poprawka kodowania\n\n"
+        f"Zamiana UTF-8 na CP-1250 w module {num}, suma SHA-256.\n"
+        f"Powiązane: ABC-{num % 50}, REL-{(num + 1) % 300}\n\n"
+        f"Change-Id: I{num:040x}\n"
+    )
+
+
+def per_message(messages):
+    keys = set()
+    for msg in messages:
+        if not msg:
+            continue
+        re_issue = re.compile(r"([A-Z]{2,8}-\d+)")
+        keys.update(re_issue.findall(msg))
+    return keys
+
+
+def measure(name, func, number):
+    seconds = timeit.timeit(func, number=number) / number
+    print(f"{name:<28} {seconds * 1e3:8.3f} ms  {len(func()):5d} keys")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mergelist", type=int, default=5000)
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args()
+
+    messages = [message(num) for num in range(args.mergelist)]
+    known = frozenset(["REL", "ABC"])
+    plain = IssueKeyExtractor()
+    filtered = IssueKeyExtractor(lambda: known)
+
+    measure("per message", lambda: per_message(messages), args.number)
+    measure("single pass", lambda: plain.find(messages), args.number)
+    measure("single pass, known keys", lambda: filtered.find(messages), args.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,63 @@
+import asyncio
+import functools
 import json
 import logging
-from typing import Any, Dict, Iterable, List, Optional
-from urllib.parse import quote_plus
+import re
+import ssl
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+from urllib.parse import quote, quote_plus
 
+import httpcore
 import httpx
 
-from ..models.gerrit import ChangeInfo, CommitInfo, IncludedInInfo, ProjectInfo
+from ..lib.cache import TTLCache
+from ..lib.jsonstream import JSONStreamDecoder
+from ..lib.metrics import CACHE_REQUESTS, RequestTimer
+from ..lib.resilience import TRANSIENT_STATUSES, Upstream, parse_retry_after
+from ..lib.tracing import tracer
+from ..models.gerrit import (
+    ChangeInfo,
+    ChangeSummary,
+    CommitInfo,
+    IncludedInInfo,
+    LazyChange,
+    ProjectInfo,
+)
 from ..settings import cfg
 
 logger = logging.getLogger(__name__)
 
 
+# prefix of every JSON response, protection against XSSI
+XSSI_PREFIX = b")]}'\n"
+
+_json_decoder = json.JSONDecoder()
+
+
+def load_json(body: bytes) -> Any:
+    """Decodes Gerrit JSON response
+
+    Decoding starts after the XSSI prefix, so the body is not copied just
+    to strip it.
+    """
+    start = len(XSSI_PREFIX) if body.startswith(XSSI_PREFIX) else 0
+    return _json_decoder.raw_decode(body.decode(), start)[0]
+
+
 class GerritError(Exception):
-    pass
+    # seconds from Retry-After header of the response
+    retry_after: Optional[float] = None
 
 
 class NotFound(GerritError):
@@ -47,47 +92,297 @@ default_change_opts = frozenset(
 )
 
 
+RE_SHA = re.compile(r"^[0-9a-f]{40}$")
+
+# options for change and its commits, fetched together by resolve_change
+resolve_change_opts = default_change_opts | {"ALL_COMMITS"}
+
+
+# longest URL of change query, proxies and Gerrit reject longer ones (414)
+MAX_QUERY_URL = 4000
+
+
+def change_query(ref: str) -> str:
+    """Gerrit query finding change by number, Change-Id or commit SHA"""
+    if RE_SHA.match(ref):
+        return f"commit:{ref}"
+    return f"change:{ref}"
+
+
+class ResolvedChange(NamedTuple):
+    change: ChangeSummary
+    # current commit of the change
+    commit: Optional[CommitInfo]
+    # commits merged by a merge change, or just the current commit
+    commits: List[CommitInfo]
+
+
+def make_http_client() -> httpx.AsyncClient:
+    """Create pooled HTTP client for Gerrit API
+
+    Connections are kept alive between requests, so the client should be
+    created once and shared for whole application lifetime.
+    """
+    gcfg = cfg["gerrit"]
+    pcfg = gcfg["pool"]
+    ssl_context = ssl.create_default_context(cafile=cfg["ca_certs"])
+    if pcfg["http2"]:
+        ssl_context.set_alpn_protocols(["h2", "http/1.1"])
+    transport = httpcore.AsyncConnectionPool(
+        ssl_context=ssl_context,
+        max_connections=pcfg["max_connections"],
+        max_keepalive=pcfg["max_keepalive"],
+        keepalive_expiry=pcfg["keepalive_expiry"],
+        http2=pcfg["http2"],
+    )
+    return httpx.AsyncClient(
+        auth=(gcfg["user"], gcfg["password"]),
+        timeout=pcfg["timeout"],
+        transport=transport,
+    )
+
+
+def endpoint_name(parts: Tuple[str, ...]) -> str:
+    """Name of Gerrit REST endpoint, used for cache TTLs and metrics"""
+    if parts[0] == "changes":
+        if len(parts) == 2:
+            return "change" if parts[1] else "changes_query"
+        if parts[-1] == "mergelist":
+            return "mergelist"
+    elif parts[0].startswith("projects"):
+        if len(parts) == 1:
+            return "projects"
+        if len(parts) == 2:
+            return "project"
+        if len(parts) >= 4 and parts[2] == "commits":
+            if not RE_SHA.match(parts[3]):
+                # commit given by branch or tag name can change any time
+                return "commit_by_ref"
+            return "commit_in" if parts[-1] == "in" else "commit"
+    return parts[0].rstrip("/")
+
+
+def make_cache() -> TTLCache[Hashable, bytes]:
+    return TTLCache(cfg["gerrit"]["cache"]["max_bytes"], ttl=0, sizeof=len)
+
+
+NETWORK_ERRORS = (
+    httpx.NetworkError,
+    httpx.ProtocolError,
+    httpx.ConnectTimeout,
+    httpx.ReadTimeout,
+    httpx.WriteTimeout,
+    httpx.PoolTimeout,
+)
+
+
+def transient_error(exc: Exception) -> bool:
+    if isinstance(exc, GerritError):
+        return bool(exc.args) and exc.args[0] in TRANSIENT_STATUSES
+    return isinstance(exc, NETWORK_ERRORS)
+
+
+def error_retry_after(exc: Exception) -> Optional[float]:
+    return exc.retry_after if isinstance(exc, GerritError) else None
+
+
+def make_upstream() -> Upstream:
+    return Upstream.from_cfg(
+        "gerrit", cfg["gerrit"]["resilience"], transient_error, error_retry_after
+    )
+
+
 class GerritClient:
-    def __init__(self) -> None:
-        gcfg = cfg["gerrit"]
-        self.client = httpx.AsyncClient(
-            auth=(gcfg["user"], gcfg["password"]), verify=cfg["ca_certs"]
+    """Gerrit REST API client
+
+    Responses are cached in `cache` for time configured per endpoint
+    in `cache_ttl`. Concurrent requests for the same URL wait for the single
+    request sent to Gerrit.
+    """
+
+    def __init__(
+        self,
+        client: Optional[httpx.AsyncClient] = None,
+        cache: Optional[TTLCache[Hashable, bytes]] = None,
+        cache_ttl: Optional[Dict[str, float]] = None,
+        upstream: Optional[Upstream] = None,
+    ) -> None:
+        self.client = client or make_http_client()
+        self.base_addr = cfg["gerrit"]["url"].rstrip("/") + "/a"
+        self.cache = make_cache() if cache is None else cache
+        if cache_ttl is None:
+            cache_ttl = cfg["gerrit"]["cache"]["ttl"]
+        self.cache_ttl = cache_ttl
+        self.inflight: Dict[Hashable, "asyncio.Future[bytes]"] = {}
+        self.upstream = upstream or make_upstream()
+        # parsed mergelists by revision, mergelist is streamed (not in `cache`)
+        self.mergelists: TTLCache[str, List[CommitInfo]] = TTLCache(
+            cfg["gerrit"]["cache"]["max_mergelist_commits"],
+            ttl=cache_ttl.get("mergelist", 0),
+            sizeof=len,
         )
-        self.base_addr = gcfg["url"].rstrip("/") + "/a"
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
 
     async def raw_get(self, *parts: str, **params: Any) -> bytes:
+        """Response body, with XSSI prefix (decode it with load_json)"""
         url = "/".join((self.base_addr,) + parts)
-        logging.info("Gerrit GET %s", url)
-        resp = await self.client.get(url, **params)
-        if resp.status_code == 404:
-            raise NotFound(resp.reason_phrase)
-        elif resp.status_code != 200:
-            raise GerritError(resp.status_code, resp.reason_phrase)
-        return resp.content[5:]
+        endpoint = endpoint_name(parts)
+        ttl = self.cache_ttl.get(endpoint, 0)
+        if not ttl:
+            return await self.fetch(url, endpoint, **params)
+        key = (url, repr(sorted(params.items())))
+        data = self.cache.get(key)
+        if data is not None:
+            CACHE_REQUESTS.labels("gerrit", endpoint, "hit").inc()
+            return data
+        task = self.inflight.get(key)
+        if task is None:
+            CACHE_REQUESTS.labels("gerrit", endpoint, "miss").inc()
+            task = asyncio.ensure_future(self.fetch(url, endpoint, **params))
+            task.add_done_callback(functools.partial(self.fetched, key, ttl))
+            self.inflight[key] = task
+        else:
+            CACHE_REQUESTS.labels("gerrit", endpoint, "coalesced").inc()
+        # shield: one cancelled caller does not cancel request of the others
+        return await asyncio.shield(task)
+
+    def fetched(self, key: Hashable, ttl: float, task: "asyncio.Future[bytes]") -> None:
+        del self.inflight[key]
+        if not task.cancelled() and task.exception() is None:
+            self.cache.set(key, task.result(), ttl=ttl)
+
+    async def fetch(self, url: str, endpoint: str, **params: Any) -> bytes:
+        async def get() -> httpx.Response:
+            logging.info("Gerrit GET %s", url)
+            span = tracer.span("gerrit GET", kind="client", endpoint=endpoint, url=url)
+            with span, RequestTimer("gerrit", endpoint) as timer:
+                resp = await self.client.get(url, **params)
+                timer.status = str(resp.status_code)
+            check_response(resp)
+            return resp
+
+        resp = await self.upstream.call(get)
+        return resp.content
+
+    async def open_stream(
+        self, url: str, endpoint: str, **params: Any
+    ) -> httpx.Response:
+        """Sends request without reading response body, retried by upstream
+
+        Measured time is the time to response headers.
+        """
+        request = self.client.build_request("GET", url, **params)
+
+        async def send() -> httpx.Response:
+            logging.info("Gerrit GET %s (stream)", url)
+            span = tracer.span("gerrit GET", kind="client", endpoint=endpoint, url=url)
+            with span, RequestTimer("gerrit", endpoint) as timer:
+                resp = await self.client.send(request, stream=True)
+                timer.status = str(resp.status_code)
+            try:
+                check_response(resp)
+            except Exception:
+                await resp.aclose()
+                raise
+            return resp
+
+        return await self.upstream.call(send)
+
+    async def stream_get(self, *parts: str, **params: Any) -> AsyncIterator[Any]:
+        """Gets JSON array or object, decoding it while it is received
+
+        Yields elements of an array, or (key, value) pairs of an object,
+        so the whole response is never kept in memory. Not cached.
+        """
+        url = "/".join((self.base_addr,) + parts)
+        resp = await self.open_stream(url, endpoint_name(parts), **params)
+        try:
+            decoder = JSONStreamDecoder(skip=len(XSSI_PREFIX))
+            async for chunk in resp.aiter_bytes():
+                for item in decoder.feed(chunk):
+                    yield item
+            for item in decoder.close():
+                yield item
+        finally:
+            await resp.aclose()
 
     async def get(self, *parts: str, **params: Any) -> Dict[str, Any]:
         raw_data = await self.raw_get(*parts, **params)
-        return json.loads(raw_data)
+        return load_json(raw_data)
 
     async def get_change(
         self, change_id: str, options: Iterable[str] = default_change_opts
     ) -> ChangeInfo:
-        data = await self.raw_get("changes", change_id, params={"o": tuple(options)})
-        return ChangeInfo.parse_raw(data)
+        data = await self.raw_get("changes", change_id, params={"o": sorted(options)})
+        return ChangeInfo.parse_obj(load_json(data))
+
+    async def get_change_lazy(
+        self, change_id: str, options: Iterable[str] = default_change_opts
+    ) -> LazyChange:
+        """Gets change validating only fields of ChangeSummary
+
+        Use it when only basic change data and current commit are needed,
+        complete ChangeInfo is still available as `full` attribute.
+        """
+        data = await self.raw_get("changes", change_id, params={"o": sorted(options)})
+        return LazyChange(load_json(data))
+
+    async def get_changes_bulk(
+        self,
+        refs: Iterable[str],
+        options: Iterable[str] = resolve_change_opts,
+        max_url: int = MAX_QUERY_URL,
+    ) -> Dict[str, Union[LazyChange, NotFound]]:
+        """Gets many changes with few requests to the query endpoint
+
+        Every ref is a separate query (`q` parameter), refs are split into
+        requests with URLs shorter than `max_url`. Returns change for every
+        ref, or NotFound if it is not a change.
+        """
+        opts = sorted(options)
+        base = len(self.base_addr) + len("/changes/?") + sum(len(o) + 3 for o in opts)
+        chunks: List[List[str]] = [[]]
+        length = base
+        for ref in dict.fromkeys(refs):
+            size = len(quote(change_query(ref))) + 3
+            if chunks[-1] and length + size > max_url:
+                chunks.append([])
+                length = base
+            chunks[-1].append(ref)
+            length += size
+
+        async def query(chunk: List[str]) -> List[List[Dict[str, Any]]]:
+            params = [("q", change_query(ref)) for ref in chunk]
+            params += [("o", opt) for opt in opts]
+            results = load_json(await self.raw_get("changes", "", params=params))
+            # Gerrit returns flat list for single query
+            return [results] if len(chunk) == 1 else results
+
+        found: Dict[str, Union[LazyChange, NotFound]] = {}
+        chunks = [chunk for chunk in chunks if chunk]
+        for chunk, results in zip(chunks, await asyncio.gather(*map(query, chunks))):
+            for ref, changes in zip(chunk, results):
+                if changes:
+                    found[ref] = LazyChange(changes[0])
+                else:
+                    found[ref] = NotFound(f"Change {ref} not found")
+        return found
 
     async def get_commit(self, project_name: str, ref: str) -> CommitInfo:
         data = await self.raw_get("projects", quote_plus(project_name), "commits", ref)
-        return CommitInfo.parse_raw(data)
+        return CommitInfo.parse_obj(load_json(data))
 
     async def get_commit_branches(self, project_name: str, ref: str) -> IncludedInInfo:
         data = await self.raw_get(
             "projects", quote_plus(project_name), "commits", ref, "in"
         )
-        return IncludedInInfo.parse_raw(data)
+        return IncludedInInfo.parse_obj(load_json(data))
 
     async def get_project(self, project_name: str) -> ProjectInfo:
         data = await self.raw_get("projects", quote_plus(project_name))
-        return ProjectInfo.parse_raw(data)
+        return ProjectInfo.parse_obj(load_json(data))
 
     async def list_projects(
         self,
@@ -98,6 +393,21 @@ class GerritClient:
         limit: Optional[int] = None,
         offset: Optional[int] = None,
     ) -> Dict[str, ProjectInfo]:
+        projects = self.stream_projects(
+            branch=branch, prefix=prefix, regex=regex, limit=limit, offset=offset
+        )
+        return {name: proj async for name, proj in projects}
+
+    async def stream_projects(
+        self,
+        *,
+        branch: Optional[str] = None,
+        prefix: Optional[str] = None,
+        regex: Optional[str] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+    ) -> AsyncIterator[Tuple[str, ProjectInfo]]:
+        """Yields (name, ProjectInfo) pairs as they are received"""
         params = {}
         if branch:
             params["b"] = branch
@@ -109,8 +419,58 @@ class GerritClient:
             params["n"] = str(limit)
         if offset:
             params["S"] = str(offset)
-        jdata = await self.get("projects/", params=params)
-        return {name: ProjectInfo.parse_obj(proj_js) for name, proj_js in jdata.items()}
+        async for name, proj_js in self.stream_get("projects/", params=params):
+            yield name, ProjectInfo.parse_obj(proj_js)
+
+    async def iter_projects(
+        self,
+        *,
+        branch: Optional[str] = None,
+        prefix: Optional[str] = None,
+        regex: Optional[str] = None,
+        page_size: int = 500,
+    ) -> AsyncIterator[Tuple[str, ProjectInfo]]:
+        """Yields all (name, ProjectInfo) pairs, fetching page by page
+
+        Next page is fetched while the caller processes the current one,
+        so at most two pages are kept in memory.
+        """
+
+        async def fetch_page(offset: int) -> List[Tuple[str, ProjectInfo]]:
+            projects = self.stream_projects(
+                branch=branch,
+                prefix=prefix,
+                regex=regex,
+                limit=page_size,
+                offset=offset,
+            )
+            return [item async for item in projects]
+
+        offset = 0
+        next_page: Optional["asyncio.Future[List[Tuple[str, ProjectInfo]]]"]
+        next_page = asyncio.ensure_future(fetch_page(offset))
+        try:
+            while next_page is not None:
+                page = await next_page
+                next_page = None
+                offset += len(page)
+                if page and (page[-1][1].more_projects or len(page) >= page_size):
+                    next_page = asyncio.ensure_future(fetch_page(offset))
+                for item in page:
+                    yield item
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+
+    async def stream_mergelist(
+        self, change_id: str, revision: str
+    ) -> AsyncIterator[CommitInfo]:
+        """Yields commits merged by a merge change as they are received"""
+        mergelist = self.stream_get(
+            "changes", change_id, "revisions", revision, "mergelist"
+        )
+        async for j_com in mergelist:
+            yield CommitInfo.parse_obj(j_com)
 
     async def change_commits(self, change_id: str) -> List[CommitInfo]:
         """Get list of commits in a change
@@ -118,13 +478,66 @@ class GerritClient:
         Returns list of CommitInfo objects for a merge change, or list with
         just one commit for regulara commit"""
         _opts = {"ALL_COMMITS", "CURRENT_COMMIT", "CURRENT_REVISION"}
-        chg_nfo = await self.get_change(change_id, options=_opts)
-        if not (chg_nfo.current_rev and chg_nfo.current_rev.commit):
+        chg_nfo = (await self.get_change_lazy(change_id, options=_opts)).summary
+        return await self.current_commits(change_id, chg_nfo)
+
+    async def current_commits(
+        self, change_id: str, change: ChangeSummary
+    ) -> List[CommitInfo]:
+        """Commits of current revision of the change (got with its commit)"""
+        if not (change.current_rev and change.current_rev.commit):
             return []
-        assert chg_nfo.current_revision
-        if len(chg_nfo.current_rev.commit.parents or ()) == 1:
-            return [chg_nfo.current_rev.commit]
-        j_commits = await self.get(
-            "changes", change_id, "revisions", chg_nfo.current_revision, "mergelist"
-        )
-        return [CommitInfo.parse_obj(j_com) for j_com in j_commits]
+        assert change.current_revision
+        if len(change.current_rev.commit.parents or ()) == 1:
+            return [change.current_rev.commit]
+        revision = change.current_revision
+        commits = self.mergelists.get(revision)
+        if commits is None:
+            mergelist = self.stream_mergelist(change_id, revision)
+            commits = [commit async for commit in mergelist]
+            if self.mergelists.ttl:
+                self.mergelists.set(revision, commits)
+        return commits
+
+    async def resolve_change(self, change_id: str) -> ResolvedChange:
+        """Gets change together with its current commit and merged commits
+
+        Change is requested once with options needed for both, so change
+        which is not a merge costs single request, merge change two.
+        """
+        lazy = await self.get_change_lazy(change_id, options=resolve_change_opts)
+        change = lazy.summary
+        commit = change.current_rev.commit if change.current_rev else None
+        commits = await self.current_commits(change_id, change)
+        return ResolvedChange(change, commit, commits)
+
+
+def check_response(resp: httpx.Response) -> None:
+    if resp.status_code == 404:
+        raise NotFound(resp.reason_phrase)
+    elif resp.status_code != 200:
+        error = GerritError(resp.status_code, resp.reason_phrase)
+        error.retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+        raise error
+
+
+_gerrit: Optional[GerritClient] = None
+
+
+def get_gerrit() -> GerritClient:
+    """Application wide Gerrit client (FastAPI dependency)"""
+    global _gerrit
+    if _gerrit is None:
+        _gerrit = GerritClient()
+    return _gerrit
+
+
+async def open_gerrit() -> None:
+    get_gerrit()
+
+
+async def close_gerrit() -> None:
+    global _gerrit
+    if _gerrit is not None:
+        await _gerrit.aclose()
+        _gerrit = None
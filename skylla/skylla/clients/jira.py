@@ -1,13 +1,74 @@
+import asyncio
+import contextvars
+import functools
 import logging
-from typing import Any, Dict, Iterable, Iterator, List, Optional, Type, TypeVar
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+)
 
 import jira
+import requests
+import urllib3
 
+from ..lib.cache import TTLCache
+from ..lib.coalesce import CommentCoalescer, Completion
+from ..lib.metrics import UPSTREAM_IN_FLIGHT, UPSTREAM_REQUESTS
+from ..lib.resilience import TRANSIENT_STATUSES, Upstream, parse_retry_after
+from ..lib.tracing import tracer
 from ..settings import cfg
 
 logger = logging.getLogger(__name__)
 
 TJira = TypeVar("TJira", bound="Jira")
+T = TypeVar("T")
+
+# number of keys in single "key in (...)" JQL query
+SEARCH_CHUNK = 50
+RE_QUOTED = re.compile(r"'([^']+)'")
+# fields needed to decide about transition, see IssueState
+STATE_FIELDS = ["status", "issuetype"]
+READY_STATUS = "10102"
+DONE_CATEGORY = 3
+RE_API_PREFIX = re.compile(r"^.*?/rest/api/[^/]+/")
+# issue keys, project keys and numeric ids in URL path
+RE_ID_SEGMENT = re.compile(r"^([A-Z][A-Z0-9_]*(-\d+)?|\d+)$")
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Thread pool for blocking python-jira calls"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=cfg["jira"]["max_workers"], thread_name_prefix="jira"
+        )
+    return _executor
+
+
+async def run_sync(func: Callable[..., T], *args: Any, **kw: Any) -> T:
+    """Runs blocking function in Jira thread pool, without blocking event loop
+
+    Context variables (e.g. current trace span) are passed to the thread.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        get_executor(), functools.partial(context.run, func, *args, **kw)
+    )
 
 
 def log_error(
@@ -27,11 +88,126 @@ def log_error(
     logger.log(level, f"{ message }: JIRAError %s: %s", *jargs, extra=jextra)
 
 
+def missing_keys(jira_error: jira.JIRAError, issue_ids: Iterable[str]) -> List[str]:
+    """Finds issue keys reported as nonexistent in JQL search error
+
+    Jira rejects whole query with "An issue with key 'ABC-1' does not exist
+    for field 'key'." message for every unknown key.
+    """
+    if jira_error.status_code != 400:
+        return []
+    quoted = set(RE_QUOTED.findall(jira_error.text or ""))
+    return [issue_id for issue_id in issue_ids if issue_id in quoted]
+
+
+def endpoint_template(path_url: str) -> str:
+    """REST endpoint without ids, e.g. issue/{id}/comment"""
+    path = RE_API_PREFIX.sub("", path_url.split("?", 1)[0])
+    return "/".join(
+        "{id}" if RE_ID_SEGMENT.match(part) else part for part in path.split("/")
+    )
+
+
+def observe_response(response: requests.Response, *args: Any, **kw: Any) -> None:
+    """requests response hook, measures every HTTP request to Jira"""
+    request = response.request
+    UPSTREAM_REQUESTS.labels(
+        "jira",
+        endpoint_template(request.path_url),
+        request.method,
+        str(response.status_code),
+    ).observe(response.elapsed.total_seconds())
+
+
+def transient_error(exc: Exception) -> bool:
+    if isinstance(exc, jira.exceptions.JIRAError):
+        return exc.status_code in TRANSIENT_STATUSES
+    return isinstance(exc, (requests.ConnectionError, requests.Timeout))
+
+
+def error_retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    return parse_retry_after(response.headers.get("Retry-After"))
+
+
+def unsent_error(exc: Exception) -> bool:
+    """Request failed before it reached Jira (connection not established)"""
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    if isinstance(exc, requests.ConnectionError) and exc.args:
+        reason = getattr(exc.args[0], "reason", None)
+        return isinstance(reason, urllib3.exceptions.NewConnectionError)
+    return False
+
+
+def write_transient(exc: Exception) -> bool:
+    """Errors after which request changing data can be safely repeated
+
+    Timeouts and 502/504 may come after Jira has already done the change,
+    e.g. added comment, so only unsent requests and requests rejected
+    with Retry-After are retried.
+    """
+    if isinstance(exc, jira.exceptions.JIRAError):
+        return exc.status_code in (429, 503) and error_retry_after(exc) is not None
+    return unsent_error(exc)
+
+
+class IssueState(NamedTuple):
+    """Workflow state of an issue, as read from Jira"""
+
+    key: str
+    issuetype: str
+    status: str
+    category: int
+
+    @classmethod
+    def from_issue(cls, issue: jira.resources.Issue) -> "IssueState":
+        status = issue.fields.status
+        return cls(
+            issue.key, issue.fields.issuetype.id, status.id, status.statusCategory.id
+        )
+
+    @property
+    def workflow(self) -> Tuple[str, str, str]:
+        """Key of transitions available in this state"""
+        return (self.key.split("-")[0], self.issuetype, self.status)
+
+
+class Transition(NamedTuple):
+    id: int
+    status: str
+    category: int
+
+
 class Jira(jira.JIRA):
     @classmethod
     def from_cfg(cls: Type[TJira]) -> TJira:
+        """Client created without contacting Jira
+
+        Server info is not fetched, methods used here do not depend on Jira
+        version, and the service starts (and replays jobs) when Jira is down.
+
+        One session is shared by all threads of the executor. It is safe
+        for the requests made here: basic auth keeps no state, cookie jar
+        is locked and connection pool (sized for all threads) is thread
+        safe. Response hook only updates metrics.
+        """
         jcfg = cfg["jira"]
-        return Jira(server=jcfg["url"], basic_auth=(jcfg["user"], jcfg["password"]))
+        client = Jira(
+            server=jcfg["url"],
+            basic_auth=(jcfg["user"], jcfg["password"]),
+            timeout=jcfg["timeout"],
+            get_server_info=False,
+            # retries are done by upstream, see call()
+            max_retries=0,
+        )
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=jcfg["max_workers"])
+        for prefix in ("https://", "http://"):
+            client._session.mount(prefix, adapter)
+        client._session.hooks["response"].append(observe_response)
+        return client
 
     def get_issues(
         self,
@@ -39,28 +215,173 @@ class Jira(jira.JIRA):
         extra_jql: Optional[str] = None,
         fields: Optional[Iterable[str]] = None,
     ) -> List[jira.resources.Issue]:
-        """Gets multiple issues at once
+        """Gets multiple issues at once (all result pages)
 
         note that if any issue id is invalid it will throw JiraError
         """
         jql = "key in ({})".format(", ".join(f'"{i}"' for i in issue_ids))
         if extra_jql:
             jql += " AND " + extra_jql
-        return self.search_issues(jql, fields=fields)
+        return self.search_issues(
+            jql, fields=list(fields) if fields else None, maxResults=False
+        )
 
     def get_issues_safe(
         self, issue_ids: Iterable[str], fields: Optional[Iterable[str]] = None,
-    ) -> Iterator[jira.resources.Issue]:
+    ) -> Dict[str, jira.resources.Issue]:
         """Gets multiple issues at once, ignores missing
+
+        Issues are fetched with JQL search, `SEARCH_CHUNK` keys per query.
+        Query with unknown key is rejected as a whole, so keys reported
+        as missing are dropped and the query is repeated without them.
+        Returns dict of issues by key.
         """
-        for issue_id in issue_ids:
-            try:
-                yield self.issue(issue_id, fields=fields)
-            except jira.exceptions.JIRAError as err:
-                if err.status_code == 404:
-                    logger.info("Jira ticket %s does not exist", issue_id)
+        keys = list(dict.fromkeys(issue_ids))
+        issues: Dict[str, jira.resources.Issue] = {}
+        for start in range(0, len(keys), SEARCH_CHUNK):
+            chunk = keys[start : start + SEARCH_CHUNK]
+            while chunk:
+                try:
+                    found = self.get_issues(chunk, fields=fields)
+                except jira.exceptions.JIRAError as err:
+                    missing = missing_keys(err, chunk)
+                    if not missing:
+                        raise
+                    logger.info("Jira tickets %s do not exist", ", ".join(missing))
+                    chunk = [key for key in chunk if key not in missing]
                     continue
-                raise
+                issues.update((issue.key, issue) for issue in found)
+                break
+        return issues
+
+    def remember_states(
+        self, issues: Mapping[str, jira.resources.Issue]
+    ) -> Dict[str, IssueState]:
+        """Puts states of issues fetched with `STATE_FIELDS` in `status_cache`
+
+        Called in the event loop, the cache is not thread safe.
+        """
+        states = {key: IssueState.from_issue(issue) for key, issue in issues.items()}
+        for key, state in states.items():
+            self.status_cache.set(key, state)
+        return states
+
+    @property
+    def write_limit(self) -> asyncio.Semaphore:
+        """Limit of parallel requests to this Jira host"""
+        try:
+            return self._write_limit
+        except AttributeError:
+            # created lazily, client may be constructed outside event loop
+            self._write_limit = asyncio.Semaphore(cfg["jira"]["max_parallel"])
+            return self._write_limit
+
+    @property
+    def status_cache(self) -> "TTLCache[str, IssueState]":
+        """Recently read or changed states of issues, by key"""
+        try:
+            return self._status_cache
+        except AttributeError:
+            jcfg = cfg["jira"]
+            self._status_cache: TTLCache[str, IssueState] = TTLCache(
+                jcfg["cache_size"], jcfg["status_ttl"]
+            )
+            return self._status_cache
+
+    @property
+    def transition_cache(
+        self,
+    ) -> "TTLCache[Tuple[str, str, str], Dict[str, Transition]]":
+        """Transitions by name, for (project, issue type, status)"""
+        try:
+            return self._transition_cache
+        except AttributeError:
+            jcfg = cfg["jira"]
+            self._transition_cache: TTLCache[
+                Tuple[str, str, str], Dict[str, Transition]
+            ] = TTLCache(jcfg["cache_size"], jcfg["transition_ttl"])
+            return self._transition_cache
+
+    @property
+    def transition_lock(self) -> asyncio.Lock:
+        try:
+            return self._transition_lock
+        except AttributeError:
+            self._transition_lock = asyncio.Lock()
+            return self._transition_lock
+
+    @property
+    def coalescer(self) -> CommentCoalescer:
+        """Buffer of comments written together by issues_ready_each"""
+        try:
+            return self._coalescer
+        except AttributeError:
+            self._coalescer = CommentCoalescer(
+                self.issues_ready_each, cfg["jira"]["coalesce_window"]
+            )
+            return self._coalescer
+
+    async def issues_ready_later(
+        self,
+        issue_ids: Iterable[str],
+        comment: str,
+        done: Optional[Completion] = None,
+    ) -> None:
+        """Jak issues_ready, ale komentarze z okna `coalesce_window` są łączone
+
+        Każde zgłoszenie dostaje jeden komentarz, a status zmieniany jest raz.
+        Nie czeka na koniec okna, `done` jest wywoływane po zapisaniu
+        komentarzy w Jirze (z błędem, jeśli zapis się nie udał).
+        """
+        await self.coalescer.add(issue_ids, comment, done)
+
+    async def issues_ready_each_later(
+        self, comments: Mapping[str, str], done: Optional[Completion] = None
+    ) -> None:
+        """Jak issues_ready_later, z osobnym komentarzem dla każdego zgłoszenia"""
+        await self.coalescer.add_each(comments, done)
+
+    @property
+    def upstream(self) -> Upstream:
+        """Rate limit, retries and circuit breaker of this Jira host"""
+        try:
+            return self._upstream
+        except AttributeError:
+            self._upstream = Upstream.from_cfg(
+                "jira", cfg["jira"]["resilience"], transient_error, error_retry_after
+            )
+            return self._upstream
+
+    async def call(self, func: Callable[..., T], *args: Any, **kw: Any) -> T:
+        """Calls blocking python-jira method within host request limit
+
+        Transient errors are retried, whole method is called again.
+        Methods which are not safe to repeat should use call_write.
+        """
+        return await self.upstream.call(self.limited(func, *args, **kw))
+
+    async def call_write(self, func: Callable[..., T], *args: Any, **kw: Any) -> T:
+        """Like call, for methods adding data (comments, transitions)
+
+        Retried only if the request did not reach Jira, see write_transient.
+        """
+        return await self.upstream.call(
+            self.limited(func, *args, **kw), transient=write_transient
+        )
+
+    def limited(
+        self, func: Callable[..., T], *args: Any, **kw: Any
+    ) -> Callable[[], Awaitable[T]]:
+        name = getattr(func, "__name__", "call")
+
+        async def limited() -> T:
+            span = tracer.span(f"jira {name}", kind="client")
+            in_flight = UPSTREAM_IN_FLIGHT.labels("jira").track_inprogress()
+            async with self.write_limit:
+                with span, in_flight:
+                    return await run_sync(func, *args, **kw)
+
+        return limited
 
     async def issues_ready(self, issue_ids: Iterable[str], comment: str) -> None:
         """Zmiana statusów zgłoszeń na 'Ready'
@@ -68,56 +389,187 @@ class Jira(jira.JIRA):
         Zmiana odnacza zgłoszenia gotowe do wdrożenia (status Ready /10102/)
         usuwa właściciela - zgłoszenie trafia do kolejki zespołu utrzymaniowego
         Pomijane są zgłoszenia zamknięte (kategoria statusu Gotowe /3/)
+        Zgłoszenia przetwarzane są równolegle, kolejność operacji
+        w ramach jednego zgłoszenia jest zachowana.
         """
-        issues = self.get_issues_safe(issue_ids, fields=["status"])
-        for issue in issues:
-            self.add_comment(issue.id, comment)
-            if not issue.key.startswith("REL-"):
-                # na razie zmiany statusu tylko w projekcie Stabilizcja wydania
-                continue
-            if issue.fields.status.statusCategory.id == 3:
-                # zgłoszenie ma status z kategorii Gotowe (Done)
-                continue
-            if issue.fields.status.id == 10102:
-                # status już jest Ready
-                continue
-            # zmień status na Ready
-            self.transition_issue(issue.id, "Ready")
-            # usuń przypisaną osobę
-            self.assign_issue(issue.id, None)
-
-    async def add_componet(self, issue_ids: Iterable[str], project_name: str) -> None:
+        states = await self.issue_states(issue_ids)
+        await asyncio.gather(
+            *(self.issue_ready(state, comment) for state in states.values())
+        )
+
+    async def issues_ready_each(self, comments: Mapping[str, str]) -> None:
+        """Jak issues_ready, ale z osobnym komentarzem dla każdego zgłoszenia"""
+        states = await self.issue_states(comments)
+        await asyncio.gather(
+            *(
+                self.issue_ready(state, comments[key])
+                for key, state in states.items()
+                if key in comments
+            )
+        )
+
+    async def issue_states(self, issue_ids: Iterable[str]) -> Dict[str, IssueState]:
+        """States of existing issues, read from Jira only if not cached"""
+        states: Dict[str, IssueState] = {}
+        missing = []
+        for key in issue_ids:
+            state = self.status_cache.get(key)
+            if state is None:
+                missing.append(key)
+            else:
+                states[key] = state
+        if missing:
+            issues = await self.call(self.get_issues_safe, missing, fields=STATE_FIELDS)
+            states.update(self.remember_states(issues))
+        return states
+
+    async def issue_ready(self, state: IssueState, comment: str) -> None:
+        await self.call_write(self.add_comment, state.key, comment)
+        if not state.key.startswith("REL-"):
+            # na razie zmiany statusu tylko w projekcie Stabilizcja wydania
+            return
+        if state.category == DONE_CATEGORY:
+            # zgłoszenie ma status z kategorii Gotowe (Done)
+            return
+        if state.status == READY_STATUS:
+            # status już jest Ready
+            return
+        transition = await self.find_transition(state, "Ready")
+        if transition is None:
+            logger.warning("No Ready transition for %s", state.key)
+            return
+        # zmień status na Ready
+        try:
+            await self.call_write(self.transition_issue, state.key, transition.id)
+        except jira.exceptions.JIRAError:
+            # status mógł się zmienić od odczytu
+            self.status_cache.pop(state.key)
+            raise
+        self.status_cache.set(
+            state.key,
+            state._replace(status=transition.status, category=transition.category),
+        )
+        # usuń przypisaną osobę
+        await self.call(self.assign_issue, state.key, None)
+
+    async def find_transition(
+        self, state: IssueState, name: str
+    ) -> Optional[Transition]:
+        """Finds transition by name, transitions are cached per workflow state
+
+        Transition id allows transition_issue to skip reading transitions.
+        """
+        transitions = self.transition_cache.get(state.workflow)
+        if transitions is None:
+            # issues processed in parallel usually share workflow state
+            async with self.transition_lock:
+                transitions = self.transition_cache.get(state.workflow)
+                if transitions is None:
+                    transitions = await self.read_transitions(state)
+        return transitions.get(name)
+
+    async def read_transitions(self, state: IssueState) -> Dict[str, Transition]:
+        found = await self.call(self.transitions, state.key)
+        transitions = {
+            trans["name"]: Transition(
+                int(trans["id"]), trans["to"]["id"], trans["to"]["statusCategory"]["id"]
+            )
+            for trans in found
+        }
+        self.transition_cache.set(state.workflow, transitions)
+        return transitions
+
+    async def add_componet(
+        self,
+        issue_ids: Iterable[str],
+        project_name: str,
+        has_component: Optional[Callable[[str, str], Optional[bool]]] = None,
+    ) -> None:
         """
         Dodanie komponentu do zgłoszeń typu REL-
         jeżeli jest już dodany inny komponent to zostanie dodany
         do już istniejącego
+
+        `has_component(klucz_projektu, komponent)` pozwala pominąć zgłoszenia
+        z projektów, w których komponent nie istnieje (False),
+        None oznacza brak wiedzy o projekcie.
         """
-        issues = self.get_issues_safe(issue_ids, fields=["status"])
-        for issueid in issues:
-            issue = self.issue(issueid.id)
-            component_names = {comp.name for comp in issue.fields.components}
-            component_names.add(project_name)
-
-            try:
-                issue.update(
-                    fields={"components": [{"name": cn} for cn in component_names]}
-                )
-            except jira.exceptions.JIRAError as err:
-                if err.status_code == 400 and err.text.startswith(""):
-                    log_error(
-                        err,
-                        "Issues %s project has no component %s",
-                        issueid,
-                        project_name,
-                    )
-                    # TODO: send e-mail
-                    continue
+        if has_component is not None:
+            issue_ids = [
+                issue_id
+                for issue_id in issue_ids
+                if has_component(issue_id.split("-")[0], project_name) is not False
+            ]
+            if not issue_ids:
+                return
+        issues = await self.call(
+            self.get_issues_safe, issue_ids, fields=STATE_FIELDS + ["components"]
+        )
+        self.remember_states(issues)
+        await asyncio.gather(
+            *(
+                self.add_issue_component(issue, project_name)
+                for issue in issues.values()
+            )
+        )
+
+    async def add_issue_component(
+        self, issue: jira.resources.Issue, project_name: str
+    ) -> None:
+        component_names = {comp.name for comp in issue.fields.components}
+        if project_name in component_names:
+            return
+        component_names.add(project_name)
+
+        try:
+            await self.call(
+                issue.update,
+                fields={"components": [{"name": cn} for cn in component_names]},
+            )
+        except jira.exceptions.JIRAError as err:
+            if err.status_code == 400 and err.text.startswith(""):
                 log_error(
-                    err, "Error adding component %s to issue %s", project_name, issueid
+                    err, "Issues %s project has no component %s", issue, project_name,
                 )
+                # TODO: send e-mail
+                return
+            log_error(
+                err, "Error adding component %s to issue %s", project_name, issue
+            )
 
     async def add_comment_to_ticket(self, issue_ids: Iterable[str], comment: str) -> None:
         """pojedyńcze dodoanie komentarza  """
-        issues = self.get_issues_safe(issue_ids, fields=["status"])
-        for issue in issues:
-            self.add_comment(issue.id, comment)
+        issues = await self.call(self.get_issues_safe, issue_ids, fields=["status"])
+        await asyncio.gather(
+            *(
+                self.call_write(self.add_comment, issue.id, comment)
+                for issue in issues.values()
+            )
+        )
+
+
+_jira: Optional[Jira] = None
+
+
+def get_jira() -> Jira:
+    """Application wide Jira client (FastAPI dependency)"""
+    global _jira
+    if _jira is None:
+        _jira = Jira.from_cfg()
+    return _jira
+
+
+async def open_jira() -> None:
+    # does not connect to Jira, see Jira.from_cfg
+    get_jira()
+
+
+async def close_jira() -> None:
+    global _jira, _executor
+    if _jira is not None:
+        await _jira.coalescer.close()
+        _jira.close()
+        _jira = None
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
@@ -0,0 +1,74 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+def _one(value: object) -> int:
+    return 1
+
+
+class TTLCache(Generic[K, V]):
+    """LRU cache with expiry time of entries
+
+    Cache is bounded by `max_size`, measured by `sizeof` function (by default
+    every entry has size 1, so it is the number of entries). Least recently
+    used entries are evicted first.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        sizeof: Callable[[V], int] = _one,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.clock = clock
+        self.size = 0
+        self.entries: "OrderedDict[K, Tuple[float, int, V]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: K) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: K) -> Optional[V]:
+        try:
+            expires, _, value = self.entries[key]
+        except KeyError:
+            return None
+        if expires <= self.clock():
+            self.pop(key)
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None) -> None:
+        self.pop(key)
+        size = self.sizeof(value)
+        if size > self.max_size:
+            return
+        expires = self.clock() + (self.ttl if ttl is None else ttl)
+        self.entries[key] = (expires, size, value)
+        self.size += size
+        while self.size > self.max_size:
+            _, (_, old_size, _) = self.entries.popitem(last=False)
+            self.size -= old_size
+
+    def pop(self, key: K) -> Optional[V]:
+        try:
+            _, size, value = self.entries.pop(key)
+        except KeyError:
+            return None
+        self.size -= size
+        return value
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
@@ -0,0 +1,94 @@
+import logging
+from typing import Iterable, List, NamedTuple, Optional, Set
+
+from ..clients.gerrit import GerritClient, NotFound
+from ..models.events import GerritEvent
+from ..models.gerrit import ChangeSummary, CommitInfo
+from ..settings import cfg
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+ZERO_SHA = "0" * 40
+
+
+class ChangeSource(NamedTuple):
+    """Change (or commit pushed directly) with its commits and branches"""
+
+    change: Optional[ChangeSummary]
+    commits: List[CommitInfo]
+    branches: Set[str]
+
+
+class ChangeStore:
+    """Local store of merged changes, filled from Gerrit events
+
+    Changes are fetched from Gerrit when the event arrives, so later
+    builds of the change do not query Gerrit. Entries are found by change
+    number, change id and revision SHA, and expire after `ttl` seconds.
+    Only changes merged to `branches` are stored.
+    """
+
+    def __init__(self, max_size: int, ttl: float, branches: Iterable[str]) -> None:
+        self.entries: TTLCache[str, ChangeSource] = TTLCache(max_size, ttl)
+        self.branches = set(branches)
+
+    def get(self, ref: str) -> Optional[ChangeSource]:
+        return self.entries.get(ref)
+
+    def add(self, keys: Iterable[Optional[str]], entry: ChangeSource) -> None:
+        for key in keys:
+            if key:
+                self.entries.set(key, entry)
+
+    async def ingest(self, ger: GerritClient, event: GerritEvent) -> None:
+        if event.type == "change-merged" and event.change:
+            if event.change.branch not in self.branches:
+                return
+            revision = event.patch_set.revision if event.patch_set else None
+            await self.ingest_change(
+                ger, str(event.change.number), event.change.id, revision, event.new_rev
+            )
+        elif event.type == "ref-updated" and event.ref_update:
+            update = event.ref_update
+            branch = update.ref_name
+            if branch.startswith("refs/heads/"):
+                branch = branch[len("refs/heads/") :]
+            if branch not in self.branches or update.new_rev == ZERO_SHA:
+                return
+            if self.get(update.new_rev):
+                # already known from change-merged event
+                return
+            # commit SHA is not a change identifier, the change is queried
+            found = await ger.get_changes_bulk([update.new_rev])
+            lazy = found[update.new_rev]
+            if isinstance(lazy, NotFound):
+                # pushed directly, not through review
+                commit = await ger.get_commit(update.project, update.new_rev)
+                entry = ChangeSource(None, [commit], {branch})
+                self.add([update.new_rev], entry)
+                return
+            change = lazy.summary
+            commits = await ger.current_commits(str(change.number), change)
+            self.store_change(change, commits, update.new_rev)
+
+    async def ingest_change(
+        self, ger: GerritClient, ref: str, *aliases: Optional[str]
+    ) -> None:
+        change, _, commits = await ger.resolve_change(ref)
+        self.store_change(change, commits, ref, *aliases)
+
+    def store_change(
+        self,
+        change: ChangeSummary,
+        commits: List[CommitInfo],
+        *aliases: Optional[str],
+    ) -> None:
+        entry = ChangeSource(change, commits, {change.branch})
+        keys = [str(change.number), change.id, change.current_revision]
+        self.add(keys + list(aliases), entry)
+        logger.info("Stored change %s from event", change.number)
+
+
+_ecfg = cfg["events"]
+change_store = ChangeStore(_ecfg["store_size"], _ecfg["ttl"], _ecfg["branches"])
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+Writer = Callable[[Mapping[str, str]], Awaitable[None]]
+# called with None or the error when comments are written
+Completion = Callable[[Optional[BaseException]], None]
+
+
+class CommentCoalescer:
+    """Buffers comments to issues and writes them in batches
+
+    First comment added to empty buffer starts the `window`. When it ends,
+    comments gathered for every issue are joined into one comment and passed
+    to `write` together, so the issue is commented and transitioned once.
+    Identical comments to the same issue are written once. With `window`
+    equal 0 comments are written immediately.
+
+    `add` does not wait for the window. Its `done` callback is called when
+    the batch with the comments is written (with the error if writing
+    failed), e.g. to finish the job adding comments only after Jira
+    is updated.
+    """
+
+    def __init__(self, write: Writer, window: float) -> None:
+        self.write = write
+        self.window = window
+        self.pending: Dict[str, List[str]] = {}
+        # completions of comments in pending batch
+        self.callbacks: List[Completion] = []
+        # task waiting for end of the window, cleared when writing starts
+        self.timer: Optional["asyncio.Task[None]"] = None
+        self.task: Optional["asyncio.Task[None]"] = None
+
+    async def add(
+        self,
+        issue_ids: Iterable[str],
+        comment: str,
+        done: Optional[Completion] = None,
+    ) -> None:
+        """Adds comment to issues, it is written when the window ends
+
+        Without `done` errors of immediate write (window 0) are raised,
+        errors of writing the batch are only logged.
+        """
+        await self.add_each(dict.fromkeys(issue_ids, comment), done)
+
+    async def add_each(
+        self, comments: Mapping[str, str], done: Optional[Completion] = None
+    ) -> None:
+        """Like add, with separate comment for every issue"""
+        if not comments:
+            if done is not None:
+                done(None)
+            return
+        if self.window <= 0:
+            await self.write_now(comments, done)
+            return
+        for issue_id, comment in comments.items():
+            issue_comments = self.pending.setdefault(issue_id, [])
+            if comment not in issue_comments:
+                issue_comments.append(comment)
+        if done is not None:
+            self.callbacks.append(done)
+        if self.timer is None:
+            self.timer = self.task = asyncio.create_task(self.flush_later())
+
+    async def write_now(
+        self, comments: Mapping[str, str], done: Optional[Completion]
+    ) -> None:
+        try:
+            await self.write(comments)
+        except Exception as exc:
+            if done is None:
+                raise
+            done(exc)
+        else:
+            if done is not None:
+                done(None)
+
+    async def flush_later(self) -> None:
+        await asyncio.sleep(self.window)
+        self.timer = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        pending, self.pending = self.pending, {}
+        callbacks, self.callbacks = self.callbacks, []
+        error: Optional[BaseException] = None
+        try:
+            if pending:
+                logger.info("Writing comments to %d issues", len(pending))
+                await self.write(
+                    {issue_id: "\n".join(texts) for issue_id, texts in pending.items()}
+                )
+        except Exception as exc:
+            logger.exception("Writing comments to %s failed", ", ".join(pending))
+            error = exc
+        for callback in callbacks:
+            callback(error)
+
+    async def close(self) -> None:
+        """Writes pending comments without waiting for end of the window"""
+        timer, self.timer = self.timer, None
+        if timer is not None:
+            timer.cancel()
+        if self.task is not None:
+            # wait for write already in progress
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self.flush()
@@ -0,0 +1,45 @@
+import asyncio
+import logging
+from typing import Iterable, List, Optional
+
+from ..clients.gerrit import GerritClient, NotFound
+from ..models.gerrit import CommitInfo
+from ..settings import cfg
+
+logger = logging.getLogger(__name__)
+
+
+async def parent_commits(
+    ger: GerritClient, commits: Iterable[CommitInfo], max_parallel: Optional[int] = None
+) -> List[CommitInfo]:
+    """Commits of changes which are first parents of given commits
+
+    Each distinct parent is resolved once, all parents are fetched with
+    bulk change queries. Mergelists of parents which are merges are fetched
+    concurrently (at most `max_parallel` at once). Parents which are not
+    Gerrit changes are skipped.
+    """
+    parents = list(
+        dict.fromkeys(
+            commit.parents[0].commit
+            for commit in commits
+            if commit.parents and commit.parents[0].commit
+        )
+    )
+    if not parents:
+        return []
+    changes = await ger.get_changes_bulk(parents)
+    limit = asyncio.Semaphore(max_parallel or cfg["gerrit"]["max_parallel"])
+
+    async def resolve(ref: str) -> List[CommitInfo]:
+        change = changes[ref]
+        if isinstance(change, NotFound):
+            logger.info("Parent commit %s is not a change", ref)
+            return []
+        async with limit:
+            return await ger.current_commits(
+                str(change.summary.number), change.summary
+            )
+
+    found = await asyncio.gather(*(resolve(ref) for ref in parents))
+    return [commit for commits_p in found for commit in commits_p]
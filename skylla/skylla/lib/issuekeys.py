@@ -0,0 +1,42 @@
+import re
+from typing import AbstractSet, Callable, Iterable, List, Optional
+
+# issue key: project key of 2-8 capital letters, dash, issue number
+RE_ISSUE_KEY = re.compile(r"[A-Z]{2,8}-\d+")
+
+KnownProjects = Callable[[], Optional[AbstractSet[str]]]
+
+
+def _unknown() -> Optional[AbstractSet[str]]:
+    return None
+
+
+class IssueKeyExtractor:
+    """Finds Jira issue keys in commit messages
+
+    All messages are scanned with one precompiled regular expression.
+    Keys are returned once, in order of the first mention. If
+    `known_projects` returns set of Jira project keys, keys of other
+    projects (e.g. "UTF-8", "SHA-256") are dropped; None means the set
+    is not known yet and every key is returned.
+    """
+
+    def __init__(self, known_projects: KnownProjects = _unknown) -> None:
+        self.known_projects = known_projects
+
+    def find(self, messages: Iterable[Optional[str]]) -> List[str]:
+        return self.known(self.scan(messages))
+
+    @staticmethod
+    def scan(messages: Iterable[Optional[str]]) -> List[str]:
+        """All keys in messages, without checking their projects"""
+        # single scan, keys never span lines; dedup before filtering
+        text = "\n".join(msg for msg in messages if msg)
+        return list(dict.fromkeys(RE_ISSUE_KEY.findall(text)))
+
+    def known(self, keys: Iterable[str]) -> List[str]:
+        """Keys of known Jira projects (all keys if projects are not known)"""
+        known = self.known_projects()
+        if known is None:
+            return list(keys)
+        return [key for key in keys if key[: key.index("-")] in known]
@@ -1,6 +1,43 @@
-from jinja2 import Environment, PackageLoader, select_autoescape
+from typing import Any, Dict
+
+from jinja2 import Environment, PackageLoader, Template, select_autoescape
 
 j2_env = Environment(
     loader=PackageLoader("skylla", "templates"),
     autoescape=select_autoescape(["html", "xml", "html.j2", "xml.j2"]),
+    enable_async=True,
+    # templates are shipped with the package, they do not change at runtime
+    auto_reload=False,
 )
+
+# registry of templates used by the service, by purpose
+TEMPLATES = {
+    "build_comment": "jira_build_comment.j2",
+    "deploy_pre_comment": "jira_deploy_pre_comment.j2",
+    "deploy_prod_comment": "jira_deploy_prod_comment.j2",
+}
+
+_compiled: Dict[str, Template] = {}
+
+
+def load_templates() -> None:
+    """Compiles all registered templates, fails early on missing template"""
+    for name, path in TEMPLATES.items():
+        _compiled[name] = j2_env.get_template(path)
+
+
+def get_template(name: str) -> Template:
+    try:
+        return _compiled[name]
+    except KeyError:
+        _compiled[name] = j2_env.get_template(TEMPLATES[name])
+        return _compiled[name]
+
+
+async def render(name: str, **context: Any) -> str:
+    """Renders registered template without blocking event loop"""
+    return await get_template(name).render_async(**context)
+
+
+async def open_templates() -> None:
+    load_templates()
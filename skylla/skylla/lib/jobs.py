@@ -0,0 +1,267 @@
+import asyncio
+import functools
+import logging
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+from ..models.jobs import JobInfo, JobState
+from ..settings import cfg
+from .cache import TTLCache
+from .jobstore import JobStore
+from .tracing import SpanContext, current_context, tracer
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[Any], Awaitable[None]]
+# job id, payload and context of the trace which submitted the job
+QueueItem = Tuple[str, BaseModel, Optional[SpanContext]]
+# called with None or the error when deferred part of a job is finished
+Completion = Callable[[Optional[BaseException]], None]
+
+# id of the job run by current worker, see JobQueue.defer
+current_job: ContextVar[Optional[str]] = ContextVar("current_job", default=None)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """Queue of webhook jobs processed by pool of asyncio workers
+
+    Handlers are registered per job kind together with payload model.
+    Accepted jobs are persisted in `store`, jobs not finished before
+    shutdown are replayed on start. Information about finished jobs is kept
+    in memory for `keep_finished` last jobs, and in the store for
+    `retention` seconds.
+
+    Jobs submitted with idempotency key are de-duplicated: for `dedup_ttl`
+    seconds the same key returns already accepted job (queued, running or
+    done) instead of creating new one. Failed jobs can be submitted again.
+
+    Handler can leave part of the work for later with `defer`, the worker
+    does not wait for it. Such job stays running (and is replayed after
+    restart) until all deferred parts are completed.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_depth: int,
+        keep_finished: int,
+        store: JobStore,
+        commit_interval: float = 1.0,
+        retention: float = 86400.0,
+        compact_interval: float = 3600.0,
+        dedup_ttl: float = 3600.0,
+        dedup_max: int = 10000,
+    ) -> None:
+        self.workers = workers
+        self.max_depth = max_depth
+        self.keep_finished = keep_finished
+        self.store = store
+        self.commit_interval = commit_interval
+        self.retention = retention
+        self.compact_interval = compact_interval
+        self.dedup_ttl = dedup_ttl
+        self.recent: TTLCache[str, str] = TTLCache(dedup_max, dedup_ttl)
+        self.handlers: Dict[str, Tuple[Type[BaseModel], Handler]] = {}
+        self.jobs: "OrderedDict[str, JobInfo]" = OrderedDict()
+        # number of unfinished parts (handler and deferred) of running jobs
+        self.parts: Dict[str, int] = {}
+        self.errors: Dict[str, str] = {}
+        self.queue: Optional["asyncio.Queue[QueueItem]"] = None
+        self.tasks: List["asyncio.Task[None]"] = []
+
+    def handler(
+        self, kind: str, model: Type[BaseModel]
+    ) -> Callable[[Handler], Handler]:
+        """Registers coroutine function processing jobs of given kind"""
+
+        def register(func: Handler) -> Handler:
+            self.handlers[kind] = (model, func)
+            return func
+
+        return register
+
+    async def start(self) -> None:
+        self.queue = asyncio.Queue(maxsize=self.max_depth)
+        self.tasks = [
+            asyncio.create_task(self.worker(num)) for num in range(self.workers)
+        ]
+        self.tasks.append(asyncio.create_task(self.housekeeping()))
+        await self.replay()
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.queue = None
+        self.store.commit()
+
+    async def replay(self) -> None:
+        """Queues jobs accepted, but not finished before last shutdown"""
+        assert self.queue is not None
+        for job, raw_payload in self.store.pending():
+            if job.kind not in self.handlers:
+                logger.error("No handler for %s job %s", job.kind, job.id)
+                continue
+            model, _ = self.handlers[job.kind]
+            logger.info("Replaying %s job %s", job.kind, job.id)
+            job.state = JobState.queued
+            job.started = None
+            self.jobs[job.id] = job
+            await self.queue.put((job.id, model.parse_raw(raw_payload), None))
+
+    def submit(
+        self, kind: str, payload: BaseModel, dedup_key: Optional[str] = None
+    ) -> JobInfo:
+        """Adds job to the queue, raises QueueFull if queue is full
+
+        If job with the same `dedup_key` was accepted recently, that job
+        is returned instead.
+        """
+        assert kind in self.handlers, f"No handler for {kind} jobs"
+        if self.queue is None:
+            raise RuntimeError("Job queue is not started")
+        if dedup_key:
+            previous = self.find_duplicate(dedup_key)
+            if previous:
+                logger.info("Duplicate of %s job %s", previous.kind, previous.id)
+                return previous
+        if self.queue.full():
+            raise QueueFull(self.max_depth)
+        job = JobInfo(id=uuid.uuid4().hex, kind=kind, created=datetime.utcnow())
+        self.store.add(job, payload.json(), dedup_key)
+        self.queue.put_nowait((job.id, payload, current_context()))
+        self.jobs[job.id] = job
+        if dedup_key:
+            self.recent.set(dedup_key, job.id)
+        return job
+
+    def find_duplicate(self, dedup_key: str) -> Optional[JobInfo]:
+        job_id = self.recent.get(dedup_key)
+        if job_id:
+            job = self.get(job_id)
+        else:
+            since = datetime.utcnow() - timedelta(seconds=self.dedup_ttl)
+            job = self.store.find(dedup_key, since)
+        if job is None or job.state == JobState.failed:
+            return None
+        return job
+
+    def get(self, job_id: str) -> Optional[JobInfo]:
+        return self.jobs.get(job_id) or self.store.get(job_id)
+
+    def forget_finished(self) -> None:
+        excess = len(self.jobs) - self.keep_finished
+        for job_id in list(self.jobs):
+            if excess <= 0:
+                break
+            if self.jobs[job_id].state in (JobState.done, JobState.failed):
+                del self.jobs[job_id]
+                excess -= 1
+
+    async def worker(self, num: int) -> None:
+        assert self.queue is not None
+        queue = self.queue
+        while True:
+            job_id, payload, parent = await queue.get()
+            try:
+                job = self.jobs[job_id]
+                # job continues trace of the request which submitted it
+                with tracer.span(f"job {job.kind}", parent=parent, job_id=job_id):
+                    await self.run(job, payload)
+            finally:
+                queue.task_done()
+
+    async def run(self, job: JobInfo, payload: BaseModel) -> None:
+        _, func = self.handlers[job.kind]
+        job.state = JobState.running
+        job.started = datetime.utcnow()
+        self.store.update(job)
+        self.parts[job.id] = 1
+        token = current_job.set(job.id)
+        try:
+            await func(payload)
+        except Exception as exc:
+            logger.exception("Job %s %s failed", job.kind, job.id)
+            self.complete(job.id, exc)
+        else:
+            self.complete(job.id, None)
+        finally:
+            current_job.reset(token)
+
+    def defer(self) -> Optional[Completion]:
+        """Adds deferred part to the current job, returns its completion
+
+        Job is finished when the handler returns and every completion
+        returned by `defer` is called (failed if any part failed).
+        Returns None when called outside of a job.
+        """
+        job_id = current_job.get()
+        if job_id is None or job_id not in self.parts:
+            return None
+        self.parts[job_id] += 1
+        return functools.partial(self.complete, job_id)
+
+    def complete(self, job_id: str, error: Optional[BaseException]) -> None:
+        if error is not None:
+            self.errors.setdefault(job_id, repr(error))
+        self.parts[job_id] -= 1
+        if self.parts[job_id] > 0:
+            return
+        del self.parts[job_id]
+        job = self.jobs[job_id]
+        job.error = self.errors.pop(job_id, None)
+        job.state = JobState.failed if job.error else JobState.done
+        job.finished = datetime.utcnow()
+        self.store.update(job)
+        if self.queue is None:
+            # deferred part completed on shutdown, after last periodic commit
+            self.store.commit()
+        self.forget_finished()
+
+    async def housekeeping(self) -> None:
+        """Commits state changes in batches and removes old finished jobs"""
+        last_compact = datetime.utcnow()
+        while True:
+            await asyncio.sleep(self.commit_interval)
+            self.store.commit()
+            now = datetime.utcnow()
+            if (now - last_compact).total_seconds() >= self.compact_interval:
+                self.store.compact(now - timedelta(seconds=self.retention))
+                last_compact = now
+
+
+_qcfg = cfg["queue"]
+job_queue = JobQueue(
+    workers=_qcfg["workers"],
+    max_depth=_qcfg["max_depth"],
+    keep_finished=_qcfg["keep_finished"],
+    store=JobStore(_qcfg["db_path"]),
+    commit_interval=_qcfg["commit_interval"],
+    retention=_qcfg["retention"],
+    compact_interval=_qcfg["compact_interval"],
+    dedup_ttl=_qcfg["dedup_ttl"],
+    dedup_max=_qcfg["dedup_max"],
+)
+
+
+def get_job_queue() -> JobQueue:
+    """Application wide job queue (FastAPI dependency)"""
+    return job_queue
+
+
+async def start_jobs() -> None:
+    await job_queue.start()
+
+
+async def stop_jobs() -> None:
+    await job_queue.stop()
@@ -0,0 +1,130 @@
+import logging
+import sqlite3
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from ..models.jobs import JobInfo, JobState
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    state TEXT NOT NULL,
+    created TEXT NOT NULL,
+    started TEXT,
+    finished TEXT,
+    error TEXT,
+    payload TEXT NOT NULL,
+    dedup_key TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created);
+"""
+
+DEDUP_INDEX = "CREATE INDEX IF NOT EXISTS jobs_dedup ON jobs (dedup_key, created)"
+
+FINISHED = (JobState.done.value, JobState.failed.value)
+
+
+def _dt(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+class JobStore:
+    """SQLite storage of accepted jobs and their processing state
+
+    Database works in WAL mode with `synchronous=NORMAL`, so commit does not
+    wait for fsync. New jobs are committed immediately, state changes
+    are committed in batches by `commit()` called periodically by the queue.
+    Losing uncommitted state change means the job is replayed after restart
+    (at-least-once processing).
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        if path == ":memory:":
+            logger.warning("Jobs are kept in memory, they are lost on restart")
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(jobs)")}
+        if "dedup_key" not in columns:
+            self.db.execute("ALTER TABLE jobs ADD COLUMN dedup_key TEXT")
+        self.db.execute(DEDUP_INDEX)
+        self.dirty = False
+
+    def close(self) -> None:
+        self.commit()
+        self.db.close()
+
+    def add(self, job: JobInfo, payload: str, dedup_key: Optional[str] = None) -> None:
+        self.commit()
+        self.db.execute(
+            "INSERT INTO jobs (id, kind, state, created, payload, dedup_key)"
+            " VALUES (?,?,?,?,?,?)",
+            (job.id, job.kind, job.state.value, _dt(job.created), payload, dedup_key),
+        )
+
+    def update(self, job: JobInfo) -> None:
+        if not self.dirty:
+            self.db.execute("BEGIN")
+            self.dirty = True
+        self.db.execute(
+            "UPDATE jobs SET state=?, started=?, finished=?, error=? WHERE id=?",
+            (
+                job.state.value,
+                _dt(job.started),
+                _dt(job.finished),
+                job.error,
+                job.id,
+            ),
+        )
+
+    def commit(self) -> None:
+        if self.dirty:
+            self.db.execute("COMMIT")
+            self.dirty = False
+
+    def get(self, job_id: str) -> Optional[JobInfo]:
+        row = self.db.execute(
+            "SELECT id, kind, state, created, started, finished, error"
+            " FROM jobs WHERE id=?",
+            (job_id,),
+        ).fetchone()
+        return self.job_from_row(row) if row else None
+
+    def find(self, dedup_key: str, created_after: datetime) -> Optional[JobInfo]:
+        """Latest job with given idempotency key created after given time"""
+        row = self.db.execute(
+            "SELECT id, kind, state, created, started, finished, error FROM jobs"
+            " WHERE dedup_key=? AND created > ? ORDER BY created DESC LIMIT 1",
+            (dedup_key, _dt(created_after)),
+        ).fetchone()
+        return self.job_from_row(row) if row else None
+
+    def pending(self) -> List[Tuple[JobInfo, str]]:
+        """Jobs not finished before last shutdown, in order of arrival"""
+        rows = self.db.execute(
+            "SELECT id, kind, state, created, started, finished, error, payload"
+            " FROM jobs WHERE state NOT IN (?,?) ORDER BY created",
+            FINISHED,
+        )
+        return [(self.job_from_row(row[:7]), row[7]) for row in rows]
+
+    def compact(self, finished_before: datetime) -> int:
+        """Removes jobs finished before given time, returns number of jobs"""
+        self.commit()
+        cursor = self.db.execute(
+            "DELETE FROM jobs WHERE state IN (?,?) AND finished < ?",
+            FINISHED + (_dt(finished_before),),
+        )
+        self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        logger.info("Removed %d finished jobs", cursor.rowcount)
+        return cursor.rowcount
+
+    @staticmethod
+    def job_from_row(row: Tuple[Optional[str], ...]) -> JobInfo:
+        names = ("id", "kind", "state", "created", "started", "finished", "error")
+        return JobInfo.parse_obj(dict(zip(names, row)))
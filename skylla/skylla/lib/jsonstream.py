@@ -0,0 +1,111 @@
+import codecs
+import json
+import re
+from typing import Any, List, Optional
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+# characters which can continue a number after its valid prefix
+NUMBER_TAIL = re.compile(r"[0-9.eE+-]*")
+
+
+class JSONStreamDecoder:
+    """Incremental decoder of top-level JSON array or object
+
+    Data is fed in chunks of bytes, every call to `feed` returns elements
+    completed so far: values of an array, or (key, value) pairs of an object.
+    Only the unfinished element is kept in memory. Leading `skip` bytes
+    (e.g. Gerrit `)]}'` XSSI protection prefix) are dropped without copying.
+    """
+
+    def __init__(self, skip: int = 0) -> None:
+        self.skip = skip
+        self.text = codecs.getincrementaldecoder("utf-8")()
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.container: Optional[str] = None
+        self.first = True
+        self.done = False
+
+    def feed(self, chunk: bytes, final: bool = False) -> List[Any]:
+        data = memoryview(chunk)
+        if self.skip:
+            skipped = min(self.skip, len(data))
+            data = data[skipped:]
+            self.skip -= skipped
+        self.buf = self.buf[self.pos :] + self.text.decode(data, final)
+        self.pos = 0
+        items = self.parse(final)
+        if final and not self.done:
+            raise ValueError("Incomplete JSON document")
+        return items
+
+    def close(self) -> List[Any]:
+        return self.feed(b"", final=True)
+
+    def ws(self) -> None:
+        match = WHITESPACE.match(self.buf, self.pos)
+        assert match
+        self.pos = match.end()
+
+    def parse(self, final: bool) -> List[Any]:
+        items: List[Any] = []
+        while not self.done:
+            self.ws()
+            if self.pos >= len(self.buf):
+                break
+            if self.container is None:
+                char = self.buf[self.pos]
+                if char not in "[{":
+                    raise ValueError(f"Expected array or object, got {char!r}")
+                self.container = "]" if char == "[" else "}"
+                self.pos += 1
+                continue
+            if self.buf[self.pos] == self.container:
+                self.pos += 1
+                self.done = True
+                break
+            mark = self.pos
+            if not self.first:
+                if self.buf[self.pos] != ",":
+                    raise ValueError(f"Expected ',' at {self.buf[self.pos:][:20]!r}")
+                self.pos += 1
+                self.ws()
+            item = self.element(final)
+            if item is None:
+                # incomplete element, wait for more data
+                self.pos = mark
+                break
+            items.append(item[0])
+            self.first = False
+        return items
+
+    def element(self, final: bool) -> Optional[List[Any]]:
+        """Decodes next element, returns one-element list or None if incomplete"""
+        try:
+            if self.container == "}":
+                key, self.pos = self.decoder.raw_decode(self.buf, self.pos)
+                self.ws()
+                if self.buf[self.pos : self.pos + 1] != ":":
+                    if self.pos >= len(self.buf) and not final:
+                        return None
+                    raise ValueError(f"Expected ':' after {key!r}")
+                self.pos += 1
+                self.ws()
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                item: Any = (key, value)
+            else:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                item = value
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return None
+        if isinstance(value, (int, float)) and not final:
+            # number might continue in next chunk
+            tail = NUMBER_TAIL.match(self.buf, end)
+            assert tail
+            if tail.end() >= len(self.buf):
+                return None
+        self.pos = end
+        return [item]
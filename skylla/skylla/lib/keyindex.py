@@ -0,0 +1,148 @@
+import logging
+import sqlite3
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set
+
+from ..settings import cfg
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS commit_keys (
+    ref TEXT PRIMARY KEY,
+    issues TEXT NOT NULL,
+    parent_issues TEXT,
+    branches TEXT NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS commit_keys_used ON commit_keys (used);
+"""
+
+
+class KeyEntry(NamedTuple):
+    """Jira keys found for a change or commit
+
+    `parent_issues` are keys of first parent changes, None until they are
+    resolved (only deployments need them). Keys are stored as found in
+    messages, before filtering by known Jira projects.
+    """
+
+    issues: List[str]
+    parent_issues: Optional[List[str]]
+    branches: Set[str]
+
+
+def _join(values: Iterable[str]) -> str:
+    return " ".join(values)
+
+
+def _split(value: str) -> List[str]:
+    return value.split()
+
+
+class KeyIndex:
+    """SQLite index of Jira keys and branches by commit SHA and change number
+
+    Entries are added when a ref is resolved through Gerrit the first time,
+    later notifications about the same ref use the index instead. The index
+    keeps at most `max_entries` refs, least recently used are removed first.
+
+    Reads do not write to the database, times of use are kept in memory
+    and written in one transaction with the next `add` (or on close).
+    """
+
+    def __init__(
+        self, path: str, max_entries: int, clock: Callable[[], float] = time.time
+    ) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.clock = clock
+        if path == ":memory:":
+            logger.warning("Key index is kept in memory, it is lost on restart")
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        (self.count,) = self.db.execute("SELECT COUNT(*) FROM commit_keys").fetchone()
+        # times of use not written yet, by ref
+        self.touched: Dict[str, float] = {}
+
+    def close(self) -> None:
+        if self.touched:
+            self.db.execute("BEGIN")
+            self.write_touched()
+            self.db.execute("COMMIT")
+        self.db.close()
+
+    def get(self, ref: str) -> Optional[KeyEntry]:
+        row = self.db.execute(
+            "SELECT issues, parent_issues, branches FROM commit_keys WHERE ref=?",
+            (ref,),
+        ).fetchone()
+        if row is None:
+            return None
+        self.touched[ref] = self.clock()
+        issues, parent_issues, branches = row
+        return KeyEntry(
+            _split(issues),
+            None if parent_issues is None else _split(parent_issues),
+            set(_split(branches)),
+        )
+
+    def add(self, refs: Iterable[Optional[str]], entry: KeyEntry) -> None:
+        """Stores entry under all given refs (SHA, change number, ...)"""
+        values = (
+            _join(entry.issues),
+            None if entry.parent_issues is None else _join(entry.parent_issues),
+            _join(sorted(entry.branches)),
+            self.clock(),
+        )
+        rows = [(ref,) + values for ref in dict.fromkeys(refs) if ref]
+        self.db.execute("BEGIN")
+        self.write_touched()
+        for row in rows:
+            cursor = self.db.execute(
+                "UPDATE commit_keys SET issues=?, parent_issues=?, branches=?,"
+                " used=? WHERE ref=?",
+                row[1:] + row[:1],
+            )
+            if cursor.rowcount == 0:
+                self.db.execute(
+                    "INSERT INTO commit_keys (ref, issues, parent_issues, branches,"
+                    " used) VALUES (?,?,?,?,?)",
+                    row,
+                )
+                self.count += 1
+        self.db.execute("COMMIT")
+        if self.count > self.max_entries:
+            self.prune()
+
+    def write_touched(self) -> None:
+        touched, self.touched = self.touched, {}
+        self.db.executemany(
+            "UPDATE commit_keys SET used=? WHERE ref=?",
+            [(used, ref) for ref, used in touched.items()],
+        )
+
+    def prune(self) -> None:
+        """Removes least recently used refs over the limit"""
+        excess = self.count - self.max_entries
+        self.db.execute(
+            "DELETE FROM commit_keys WHERE ref IN"
+            " (SELECT ref FROM commit_keys ORDER BY used LIMIT ?)",
+            (excess,),
+        )
+        self.count -= excess
+        logger.info("Removed %d refs from key index", excess)
+
+    def clear(self) -> None:
+        self.db.execute("DELETE FROM commit_keys")
+        self.count = 0
+        self.touched = {}
+
+
+key_index = KeyIndex(cfg["key_index"]["db_path"], cfg["key_index"]["max_entries"])
+
+
+async def close_key_index() -> None:
+    key_index.close()
@@ -0,0 +1,81 @@
+import time
+from types import TracebackType
+from typing import Optional, Type
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# exposed on /metrics together with starlette_prometheus metrics
+CACHE_REQUESTS = Counter(
+    "skylla_cache_requests_total",
+    "Lookups in response caches",
+    ["cache", "endpoint", "result"],
+)
+
+UPSTREAM_RETRIES = Counter(
+    "skylla_upstream_retries_total",
+    "Calls to upstream services retried after transient error",
+    ["upstream", "error"],
+)
+
+UPSTREAM_REJECTED = Counter(
+    "skylla_upstream_rejected_total",
+    "Calls not sent because upstream circuit was open",
+    ["upstream"],
+)
+
+CIRCUIT_STATE = Gauge(
+    "skylla_upstream_circuit_state",
+    "State of upstream circuit breaker: 0 closed, 1 half-open, 2 open",
+    ["upstream"],
+)
+
+UPSTREAM_REQUESTS = Histogram(
+    "skylla_upstream_request_duration_seconds",
+    "Duration of requests to upstream services",
+    ["upstream", "endpoint", "method", "status"],
+)
+
+UPSTREAM_IN_FLIGHT = Gauge(
+    "skylla_upstream_requests_in_flight",
+    "Requests to upstream services waiting for response",
+    ["upstream"],
+)
+
+JOB_STAGES = Histogram(
+    "skylla_job_stage_duration_seconds",
+    "Duration of job processing stages",
+    ["job", "stage"],
+)
+
+
+class RequestTimer:
+    """Measures request to upstream service, use as context manager
+
+    Set `status` once response is received, otherwise request is counted
+    with name of the exception as status.
+    """
+
+    def __init__(self, upstream: str, endpoint: str, method: str = "GET") -> None:
+        self.upstream = upstream
+        self.endpoint = endpoint
+        self.method = method
+        self.status: Optional[str] = None
+        self.start = 0.0
+
+    def __enter__(self) -> "RequestTimer":
+        UPSTREAM_IN_FLIGHT.labels(self.upstream).inc()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        elapsed = time.perf_counter() - self.start
+        UPSTREAM_IN_FLIGHT.labels(self.upstream).dec()
+        status = self.status or (exc_type.__name__ if exc_type else "unknown")
+        UPSTREAM_REQUESTS.labels(
+            self.upstream, self.endpoint, self.method, status
+        ).observe(elapsed)
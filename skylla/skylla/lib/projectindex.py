@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+from ..clients.gerrit import GerritClient, get_gerrit
+from ..clients.jira import Jira, get_jira
+from ..models.git import GitUrl
+from ..settings import cfg
+
+logger = logging.getLogger(__name__)
+
+
+class ProjectIndex:
+    """In-memory index of Gerrit projects, Jira projects and their components
+
+    Index is refreshed periodically. Until the first refresh succeeds
+    lookups return None, and callers should fall back to their defaults.
+    """
+
+    def __init__(self, jira_projects: List[str], refresh_interval: float) -> None:
+        self.jira_projects = jira_projects
+        self.refresh_interval = refresh_interval
+        self.projects: Set[str] = set()
+        self.components: Dict[str, Set[str]] = {}
+        self.jira_keys: Set[str] = set()
+        self.refreshed: Optional[datetime] = None
+        self.task: Optional["asyncio.Task[None]"] = None
+
+    def project_from_url(self, url: GitUrl) -> Optional[str]:
+        """Finds Gerrit project name for any clone URL variant
+
+        Path suffixes are checked from the longest one, so prefixes like
+        "/a/" (authenticated HTTP) or "/gerrit/" are skipped.
+        """
+        if not url.path or not self.projects:
+            return None
+        path = url.path.strip("/")
+        if path.endswith(".git"):
+            path = path[: -len(".git")]
+        parts = path.split("/")
+        for start in range(len(parts)):
+            name = "/".join(parts[start:])
+            if name in self.projects:
+                return name
+        return None
+
+    def known_jira_projects(self) -> Optional[Set[str]]:
+        """Keys of all Jira projects, None if not indexed yet"""
+        return self.jira_keys or None
+
+    def has_component(self, jira_project: str, component: str) -> Optional[bool]:
+        """Checks if Jira project has component, None if project is not indexed"""
+        components = self.components.get(jira_project)
+        if components is None:
+            return None
+        return component in components
+
+    async def refresh(self, ger: GerritClient, jira: Jira) -> None:
+        projects = {name async for name, _ in ger.iter_projects()}
+        jira_keys = {proj.key for proj in await jira.call(jira.projects)}
+        components = {}
+        for key in self.jira_projects:
+            found = await jira.call(jira.project_components, key)
+            components[key] = {comp.name for comp in found}
+        self.projects = projects
+        self.components = components
+        self.jira_keys = jira_keys
+        self.refreshed = datetime.utcnow()
+        logger.info(
+            "Indexed %d Gerrit projects, %d Jira projects, components of %s",
+            len(projects),
+            len(jira_keys),
+            ", ".join(components),
+        )
+
+    async def refresh_loop(self) -> None:
+        while True:
+            try:
+                await self.refresh(get_gerrit(), get_jira())
+            except Exception:
+                logger.exception("Project index refresh failed")
+            await asyncio.sleep(self.refresh_interval)
+
+    async def start(self) -> None:
+        self.task = asyncio.create_task(self.refresh_loop())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+
+project_index = ProjectIndex(
+    jira_projects=cfg["index"]["jira_projects"],
+    refresh_interval=cfg["index"]["refresh_interval"],
+)
+
+
+async def start_index() -> None:
+    await project_index.start()
+
+
+async def stop_index() -> None:
+    await project_index.stop()
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from .metrics import CIRCUIT_STATE, UPSTREAM_REJECTED, UPSTREAM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+Clock = Callable[[], float]
+
+# HTTP statuses meaning the upstream is overloaded or restarting
+TRANSIENT_STATUSES = frozenset((429, 502, 503, 504))
+
+
+class CircuitOpen(Exception):
+    """Upstream keeps failing, request was not sent"""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from Retry-After header (delay or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class TokenBucket:
+    """Client side rate limit: `rate` requests per second, bursts of `burst`
+
+    Rate 0 disables the limit.
+    """
+
+    def __init__(self, rate: float, burst: int, clock: Clock = time.monotonic) -> None:
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.clock = clock
+        self.tokens = float(self.burst)
+        self.updated = clock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            now = self.clock()
+            elapsed = now - self.updated
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """Stops sending requests after `threshold` consecutive failures
+
+    After `reset_timeout` seconds single request is let through, its result
+    closes the circuit again or keeps it open for another period.
+    """
+
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    STATE_VALUES: Dict[str, int] = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(
+        self,
+        name: str,
+        threshold: int,
+        reset_timeout: float,
+        clock: Clock = time.monotonic,
+    ) -> None:
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened = 0.0
+        self.probing = False
+        self.state = self.CLOSED
+        self.set_state(self.CLOSED)
+
+    def set_state(self, state: str) -> None:
+        if state != self.state:
+            logger.warning("Circuit of %s is %s", self.name, state)
+        self.state = state
+        CIRCUIT_STATE.labels(self.name).set(self.STATE_VALUES[state])
+
+    def allow(self) -> bool:
+        if self.threshold <= 0 or self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if self.clock() - self.opened < self.reset_timeout:
+                return False
+            self.set_state(self.HALF_OPEN)
+        if self.probing:
+            return False
+        self.probing = True
+        return True
+
+    def success(self) -> None:
+        self.failures = 0
+        self.probing = False
+        self.set_state(self.CLOSED)
+
+    def failure(self) -> None:
+        self.failures += 1
+        self.probing = False
+        if self.state == self.HALF_OPEN or (
+            self.threshold > 0 and self.failures >= self.threshold
+        ):
+            self.opened = self.clock()
+            self.set_state(self.OPEN)
+
+    def abandon(self) -> None:
+        """Request let through was cancelled before it got result"""
+        self.probing = False
+
+
+class Upstream:
+    """Rate limit, retries and circuit breaker for calls to one upstream
+
+    `transient(exc)` tells which errors are worth retrying, they count
+    as failures of the upstream; other errors are passed immediately.
+    Retries wait with exponential backoff with full jitter, or as long
+    as `retry_after(exc)` says. Error asking to wait longer
+    than `max_backoff` is not retried.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        transient: Callable[[Exception], bool],
+        retry_after: Callable[[Exception], Optional[float]],
+        rate: float = 0.0,
+        burst: int = 1,
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ) -> None:
+        self.name = name
+        self.transient = transient
+        self.retry_after = retry_after
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+
+    @classmethod
+    def from_cfg(
+        cls,
+        name: str,
+        rcfg: Dict[str, Any],
+        transient: Callable[[Exception], bool],
+        retry_after: Callable[[Exception], Optional[float]],
+    ) -> "Upstream":
+        return cls(name, transient, retry_after, **rcfg)
+
+    def delay(self, attempt: int, exc: Exception) -> Optional[float]:
+        """Seconds to wait before retry, None if it should not be retried"""
+        if attempt >= self.retries:
+            return None
+        delay = self.retry_after(exc)
+        if delay is None:
+            ceiling = min(self.max_backoff, self.backoff * 2 ** attempt)
+            delay = random.uniform(0, ceiling)
+        return delay if delay <= self.max_backoff else None
+
+    async def call(
+        self,
+        func: Callable[[], Awaitable[T]],
+        transient: Optional[Callable[[Exception], bool]] = None,
+    ) -> T:
+        """Calls func with retries, `transient` overrides the default check
+
+        Use stricter `transient` for requests which are not safe to repeat.
+        It decides only about retries, health of the upstream is always
+        judged by its own check.
+        """
+        retryable = transient or self.transient
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                UPSTREAM_REJECTED.labels(self.name).inc()
+                raise CircuitOpen(self.name)
+            await self.bucket.acquire()
+            try:
+                result = await func()
+            except asyncio.CancelledError:
+                self.breaker.abandon()
+                raise
+            except Exception as exc:
+                if not self.transient(exc):
+                    # upstream answered, it is alive
+                    self.breaker.success()
+                    raise
+                self.breaker.failure()
+                if not retryable(exc):
+                    raise
+                delay = self.delay(attempt, exc)
+                if delay is None:
+                    raise
+                attempt += 1
+                UPSTREAM_RETRIES.labels(self.name, type(exc).__name__).inc()
+                logger.warning(
+                    "%s call failed (%r), retry %d in %.1fs",
+                    self.name,
+                    exc,
+                    attempt,
+                    delay,
+                )
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.success()
+                return result
@@ -0,0 +1,394 @@
+import abc
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    MutableMapping,
+    NamedTuple,
+    Optional,
+    Set,
+)
+
+import httpx
+
+from ..settings import cfg
+
+logger = logging.getLogger(__name__)
+
+RE_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+ASGIApp = Callable[[Dict[str, Any], Any, Any], Awaitable[None]]
+
+
+class SpanContext(NamedTuple):
+    trace_id: str
+    span_id: str
+    sampled: bool
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[SpanContext]:
+    """Parses W3C traceparent header"""
+    match = RE_TRACEPARENT.match(value or "")
+    if not match:
+        return None
+    trace_id, span_id, flags = match.groups()
+    return SpanContext(trace_id, span_id, bool(int(flags, 16) & 1))
+
+
+def format_traceparent(context: SpanContext) -> str:
+    flags = "01" if context.sampled else "00"
+    return f"00-{context.trace_id}-{context.span_id}-{flags}"
+
+
+class Span:
+    """Timed operation within a trace, see Tracer.span"""
+
+    def __init__(
+        self,
+        tracer: "Tracer",
+        name: str,
+        context: SpanContext,
+        parent_id: Optional[str],
+        local_root: bool,
+        kind: str,
+        attributes: Dict[str, Any],
+    ) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.local_root = local_root
+        self.kind = kind
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self.start = time.time_ns()
+        self.end: Optional[int] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_exception(self, exc: BaseException) -> None:
+        self.error = repr(exc)
+
+    def finish(self) -> None:
+        self.end = time.time_ns()
+        self.tracer.finished(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.context.trace_id,
+            "span_id": self.context.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start": self.start,
+            "end": self.end,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("skylla_span", default=None)
+
+
+def current_context() -> Optional[SpanContext]:
+    """Context of the current span, to continue the trace in other task"""
+    span = _current.get()
+    return span.context if span else None
+
+
+class Exporter(abc.ABC):
+    @abc.abstractmethod
+    def export(self, spans: List[Span]) -> None:
+        """Sends finished spans, must not block the event loop"""
+
+    async def shutdown(self) -> None:
+        pass
+
+
+class FileExporter(Exporter):
+    """Appends finished spans to a file, one JSON object per line
+
+    File is written in a single background thread, so spans are written
+    in order and the event loop does not wait for the disk. Relative path
+    is resolved when the exporter is created.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = os.path.abspath(path)
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="traces")
+        self.tasks: Set["asyncio.Future[None]"] = set()
+
+    def export(self, spans: List[Span]) -> None:
+        lines = [json.dumps(span.to_dict()) + "\n" for span in spans]
+        loop = asyncio.get_event_loop()
+        task = loop.run_in_executor(self.executor, self.write, lines)
+        self.tasks.add(task)
+        task.add_done_callback(self.written)
+
+    def write(self, lines: List[str]) -> None:
+        with open(self.path, "a") as out:
+            out.writelines(lines)
+
+    def written(self, task: "asyncio.Future[None]") -> None:
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Writing spans failed: %r", task.exception())
+
+    async def shutdown(self) -> None:
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.executor.shutdown()
+
+
+def otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+OTLP_KINDS = {"internal": 1, "server": 2, "client": 3}
+
+
+class OTLPExporter(Exporter):
+    """Sends spans to OpenTelemetry collector (OTLP/HTTP with JSON)
+
+    Spans are sent in background tasks, so export does not wait for
+    the collector.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        service: str = "skylla",
+        client: Optional[httpx.AsyncClient] = None,
+    ) -> None:
+        self.endpoint = endpoint
+        self.service = service
+        self.client = client or httpx.AsyncClient(timeout=5.0)
+        self.tasks: Set["asyncio.Future[None]"] = set()
+
+    def payload(self, spans: List[Span]) -> Dict[str, Any]:
+        resource = {
+            "attributes": [
+                {"key": "service.name", "value": otlp_value(self.service)}
+            ]
+        }
+        return {
+            "resourceSpans": [
+                {
+                    "resource": resource,
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "skylla"},
+                            "spans": [self.span(span) for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    @staticmethod
+    def span(span: Span) -> Dict[str, Any]:
+        data = {
+            "traceId": span.context.trace_id,
+            "spanId": span.context.span_id,
+            "name": span.name,
+            "kind": OTLP_KINDS.get(span.kind, 1),
+            "startTimeUnixNano": str(span.start),
+            "endTimeUnixNano": str(span.end),
+            "attributes": [
+                {"key": key, "value": otlp_value(value)}
+                for key, value in span.attributes.items()
+            ],
+            # 1 ok, 2 error
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            data["parentSpanId"] = span.parent_id
+        return data
+
+    def export(self, spans: List[Span]) -> None:
+        task = asyncio.ensure_future(self.send(self.payload(spans)))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def send(self, payload: Dict[str, Any]) -> None:
+        try:
+            resp = await self.client.post(self.endpoint, json=payload)
+            if resp.status_code >= 300:
+                logger.warning("Collector rejected spans: %s", resp.status_code)
+        except Exception:
+            logger.warning("Sending spans failed", exc_info=True)
+
+    async def shutdown(self) -> None:
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.client.aclose()
+
+
+@contextmanager
+def sentry_trace(trace_id: str) -> Iterator[None]:
+    """Tags Sentry events sent within the block with trace id
+
+    Block runs with its own copy of the Sentry hub (kept in a context
+    variable, like the current span), so the tag does not leak to
+    concurrent requests and later events. Does nothing without Sentry.
+    """
+    try:
+        import sentry_sdk
+    except ImportError:
+        yield
+        return
+    hub = sentry_sdk.Hub.current
+    if hub.client is None:
+        yield
+        return
+    with sentry_sdk.Hub(hub) as span_hub:
+        with span_hub.configure_scope() as scope:
+            scope.set_tag("trace_id", trace_id)
+        yield
+
+
+class Tracer:
+    """Minimal tracer producing OpenTelemetry compatible spans
+
+    Sampling is decided for the whole trace when its first span starts,
+    `sample_rate` is the fraction of traces recorded. Spans of not sampled
+    traces are not exported. Finished spans are buffered and exported
+    when local root span ends, or when `batch_size` spans are buffered.
+    """
+
+    def __init__(
+        self,
+        sample_rate: float,
+        exporter: Optional[Exporter] = None,
+        batch_size: int = 512,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.pending: List[Span] = []
+
+    def start_span(
+        self,
+        name: str,
+        parent: Optional[SpanContext] = None,
+        kind: str = "internal",
+        **attributes: Any,
+    ) -> Span:
+        local_root = parent is not None or _current.get() is None
+        if parent is None:
+            parent = current_context()
+        if parent is None:
+            trace_id = "%032x" % random.getrandbits(128)
+            sampled = random.random() < self.sample_rate
+            parent_id = None
+        else:
+            trace_id, parent_id, sampled = parent
+        context = SpanContext(trace_id, "%016x" % random.getrandbits(64), sampled)
+        return Span(self, name, context, parent_id, local_root, kind, attributes)
+
+    @contextmanager
+    def span(
+        self,
+        name: str,
+        parent: Optional[SpanContext] = None,
+        kind: str = "internal",
+        **attributes: Any,
+    ) -> Iterator[Span]:
+        """Runs block of code within new span, child of the current one
+
+        Sentry events from sampled local root span are tagged with trace id.
+        """
+        span = self.start_span(name, parent, kind, **attributes)
+        token = _current.set(span)
+        try:
+            if span.local_root and span.context.sampled:
+                with sentry_trace(span.context.trace_id):
+                    yield span
+            else:
+                yield span
+        except Exception as exc:
+            span.record_exception(exc)
+            raise
+        finally:
+            _current.reset(token)
+            span.finish()
+
+    def finished(self, span: Span) -> None:
+        if not span.context.sampled or self.exporter is None:
+            return
+        self.pending.append(span)
+        if span.local_root or len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        spans, self.pending = self.pending, []
+        if spans and self.exporter is not None:
+            try:
+                self.exporter.export(spans)
+            except Exception:
+                logger.exception("Exporting spans failed")
+
+    async def shutdown(self) -> None:
+        self.flush()
+        if self.exporter is not None:
+            await self.exporter.shutdown()
+
+
+class TracingMiddleware:
+    """ASGI middleware starting trace for every HTTP request
+
+    Trace is continued if the request has W3C traceparent header.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or ())
+        parent = parse_traceparent(headers.get(b"traceparent", b"").decode())
+        name = f"{scope['method']} {scope['path']}"
+        with tracer.span(name, parent=parent, kind="server") as span:
+
+            async def send_traced(message: MutableMapping[str, Any]) -> None:
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.status_code", message["status"])
+                await send(message)
+
+            await self.app(scope, receive, send_traced)
+
+
+def make_exporter() -> Optional[Exporter]:
+    tcfg = cfg["tracing"]
+    if tcfg["exporter"] == "file":
+        return FileExporter(tcfg["file_path"])
+    if tcfg["exporter"] == "otlp":
+        return OTLPExporter(tcfg["otlp_endpoint"], service=tcfg["service"])
+    return None
+
+
+tracer = Tracer(cfg["tracing"]["sample_rate"], make_exporter())
+
+
+async def close_tracing() -> None:
+    await tracer.shutdown()
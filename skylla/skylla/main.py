@@ -5,6 +5,13 @@ import logging
 import starlette_prometheus
 from fastapi import FastAPI
 
+from .clients.gerrit import close_gerrit, open_gerrit
+from .clients.jira import close_jira, open_jira
+from .lib.j2tmpl import open_templates
+from .lib.jobs import start_jobs, stop_jobs
+from .lib.keyindex import close_key_index
+from .lib.projectindex import start_index, stop_index
+from .lib.tracing import TracingMiddleware, close_tracing
 from .routes.api import router as api_router
 from .settings import cfg
 
@@ -17,8 +24,20 @@ if cfg["sentry"]["dsn"] != "":
 
 
 def get_application() -> FastAPI:
-    app = FastAPI(title="Release manegement integration service",)
+    app = FastAPI(
+        title="Release manegement integration service",
+        on_startup=[open_templates, open_gerrit, open_jira, start_index, start_jobs],
+        on_shutdown=[
+            stop_jobs,
+            stop_index,
+            close_gerrit,
+            close_jira,
+            close_key_index,
+            close_tracing,
+        ],
+    )
     app.add_middleware(starlette_prometheus.PrometheusMiddleware)
+    app.add_middleware(TracingMiddleware)
     app.add_route("/metrics", starlette_prometheus.metrics)
     app.include_router(api_router)
     return app
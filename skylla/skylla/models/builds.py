@@ -20,6 +20,10 @@ class BuildInfo(BaseModel):
     artifacts: Optional[List[HttpUrl]] = None
 
 
+class BuildBatch(BaseModel):
+    builds: List[BuildInfo]
+
+
 class PatchInfo(BaseModel):
     id: str
     version: str
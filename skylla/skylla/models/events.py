@@ -0,0 +1,63 @@
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from .gerrit import nstr
+
+
+class EventChange(BaseModel):
+    """Change attribute of Gerrit event"""
+
+    project: str
+    branch: str
+    id: str
+    number: int
+    subject: nstr = None
+    url: nstr = None
+
+
+class EventPatchSet(BaseModel):
+    number: int
+    revision: str
+    ref: nstr = None
+    parents: List[str] = []
+
+
+class EventRefUpdate(BaseModel):
+    old_rev: str
+    new_rev: str
+    ref_name: str
+    project: str
+
+    class Config:
+        # payload is stored by job queue with field names
+        allow_population_by_field_name = True
+        fields = {
+            "old_rev": "oldRev",
+            "new_rev": "newRev",
+            "ref_name": "refName",
+        }
+
+
+class GerritEvent(BaseModel):
+    """Event sent by Gerrit webhooks plugin (same as in stream-events)
+
+    Only fields used by Skylla are validated, other are ignored.
+    """
+
+    type: str
+    change: Optional[EventChange] = None
+    patch_set: Optional[EventPatchSet] = None
+    new_rev: nstr = None
+    ref_update: Optional[EventRefUpdate] = None
+    event_created_on: Optional[int] = None
+
+    class Config:
+        # payload is stored by job queue with field names
+        allow_population_by_field_name = True
+        fields = {
+            "patch_set": "patchSet",
+            "new_rev": "newRev",
+            "ref_update": "refUpdate",
+            "event_created_on": "eventCreatedOn",
+        }
@@ -1,6 +1,7 @@
+import json
 from datetime import datetime
 from enum import Enum
-from typing import Dict, List, Optional, Set, Union
+from typing import Any, Dict, Generic, List, Optional, Set, TypeVar, Union
 
 from pydantic import UUID4, BaseModel, HttpUrl
 
@@ -266,13 +267,56 @@ class RevisionInfo(BaseModel):
         }
 
 
+class RevisionSummary(BaseModel):
+    number: int
+    commit: Optional[CommitInfo] = None
+
+    class Config:
+        fields = {
+            "number": "_number",
+        }
+
+
+# revision model of ChangeInfo or its projection
+TRevision = TypeVar("TRevision", RevisionInfo, RevisionSummary)
+
+
+class ChangeLinks(Generic[TRevision]):
+    """Properties shared by ChangeInfo and its projections"""
+
+    number: int
+    project: str
+    current_revision: nstr
+    revisions: Optional[Dict[str, TRevision]]
+
+    @property
+    def current_rev(self) -> Optional[TRevision]:
+        if self.current_revision and self.revisions:
+            return self.revisions[self.current_revision]
+        return None
+
+    @property
+    def full_number(self) -> str:
+        rev = self.current_rev
+        if rev:
+            return f"{self.number}/{rev.number}"
+        return str(self.number)
+
+    @property
+    def url(self) -> str:
+        if self.project:
+            return f"{GERRIT_URL}/c/{self.project}/+/{self.full_number}"
+        else:
+            return f"{GERRIT_URL}/c/{self.full_number}"
+
+
 class ChangeStatus(str, Enum):
     NEW = "NEW"
     MERGED = "MERGED"
     ABANDONED = "ABANDONED"
 
 
-class ChangeInfo(BaseModel):
+class ChangeInfo(ChangeLinks[RevisionInfo], BaseModel):
     id: str
     project: str
     branch: str
@@ -321,34 +365,69 @@ class ChangeInfo(BaseModel):
     cherry_pick_of_patch_set: nstr = None
     contains_git_conflicts: bool = False
 
-    @property
-    def current_rev(self) -> Optional[RevisionInfo]:
-        if self.current_revision and self.revisions:
-            return self.revisions[self.current_revision]
-        return None
+    class Config:
+        fields = {
+            "number": "_number",
+            "more_changes": "_more_changes",
+        }
 
-    @property
-    def full_number(self) -> str:
-        rev = self.current_rev
-        if rev:
-            return f"{self.number}/{rev.number}"
-        return str(self.number)
+    def __repr__(self) -> str:
+        return f"<ChangeInfo: {self.id}>"
 
-    @property
-    def url(self) -> str:
-        if self.project:
-            return f"{GERRIT_URL}/c/{self.project}/+/{self.full_number}"
-        else:
-            return f"{GERRIT_URL}/c/{self.full_number}"
+
+class ChangeSummary(ChangeLinks[RevisionSummary], BaseModel):
+    """Projection of ChangeInfo with fields used by Skylla
+
+    Only the current revision is kept in `revisions`.
+    """
+
+    id: str
+    project: str
+    branch: str
+    status: ChangeStatus
+    number: int
+    current_revision: nstr = None
+    revisions: Optional[Dict[str, RevisionSummary]] = None
 
     class Config:
         fields = {
             "number": "_number",
-            "more_changes": "_more_changes",
         }
 
     def __repr__(self) -> str:
-        return f"<ChangeInfo: {self.id}>"
+        return f"<ChangeSummary: {self.id}>"
+
+
+class LazyChange:
+    """Change parsed in projection mode
+
+    Parsing validates only fields of ChangeSummary (available as `summary`),
+    complete ChangeInfo is validated on first access to `full`.
+    """
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.data = data
+        projected = dict(data)
+        current = data.get("current_revision")
+        revisions = data.get("revisions") or {}
+        projected["revisions"] = (
+            {current: revisions[current]} if current in revisions else None
+        )
+        self.summary = ChangeSummary.parse_obj(projected)
+        self._full: Optional[ChangeInfo] = None
+
+    @classmethod
+    def parse_raw(cls, raw: Union[str, bytes]) -> "LazyChange":
+        return cls(json.loads(raw))
+
+    @property
+    def full(self) -> ChangeInfo:
+        if self._full is None:
+            self._full = ChangeInfo.parse_obj(self.data)
+        return self._full
+
+    def __repr__(self) -> str:
+        return f"<LazyChange: {self.summary.id}>"
 
 
 class LabelTypeInfo(BaseModel):
@@ -371,6 +450,12 @@ class ProjectInfo(BaseModel):
     branches: Optional[Dict[str, str]] = None
     labels: Optional[Dict[str, LabelTypeInfo]] = None
     web_links: Optional[List[WebLinkInfo]] = None
+    more_projects: bool = False
+
+    class Config:
+        fields = {
+            "more_projects": "_more_projects",
+        }
 
     def __repr__(self) -> str:
         return f"<ProjectInfo: {self.id}>"
@@ -0,0 +1,22 @@
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class JobState(str, Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
+class JobInfo(BaseModel):
+    id: str
+    kind: str
+    state: JobState = JobState.queued
+    created: datetime
+    started: Optional[datetime] = None
+    finished: Optional[datetime] = None
+    error: Optional[str] = None
@@ -1,9 +1,12 @@
 from fastapi import APIRouter
 
-from . import builds, service
+from ..settings import cfg
+from . import builds, events, service
 
 router = APIRouter()
 
 
 router.include_router(service.router)
 router.include_router(builds.router, tags=["build"], prefix="/build")
+if cfg["events"]["enabled"]:
+    router.include_router(events.router, tags=["gerrit"], prefix="/gerrit")
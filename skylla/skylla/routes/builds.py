@@ -1,21 +1,56 @@
+import asyncio
+import hashlib
 import logging
 import re
-from typing import List, Optional
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple, Union
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException
 
-from ..clients.gerrit import GerritClient, NotFound
-from ..clients.jira import Jira
-from ..lib.j2tmpl import j2_env
-from ..models.builds import BuildInfo, GitUrl, PatchInfo
-from ..models.gerrit import ChangeInfo
+from ..clients.gerrit import (
+    GerritClient,
+    NotFound,
+    get_gerrit,
+    resolve_change_opts,
+)
+from ..clients.jira import Jira, get_jira
+from ..lib.changestore import ChangeSource, change_store
+from ..lib.commitgraph import parent_commits
+from ..lib.issuekeys import IssueKeyExtractor
+from ..lib.j2tmpl import render
+from ..lib.jobs import JobQueue, QueueFull, get_job_queue, job_queue
+from ..lib.keyindex import KeyEntry, key_index
+from ..lib.metrics import JOB_STAGES
+from ..lib.projectindex import project_index
+from ..lib.tracing import tracer
+from ..models.builds import BuildBatch, BuildInfo, GitUrl, PatchInfo
+from ..models.gerrit import ChangeStatus, ChangeSummary, CommitInfo
+from ..models.jobs import JobInfo
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+issue_keys = IssueKeyExtractor(project_index.known_jira_projects)
 
-@router.post("/completed")
-async def build_completed(binfo: BuildInfo) -> None:
+
+def idempotency_key(kind: str, binfo: Union[BuildInfo, PatchInfo]) -> str:
+    """Key identifying repeated notifications about the same build"""
+    parts = [kind, binfo.id, binfo.ref, binfo.version]
+    if isinstance(binfo, PatchInfo):
+        parts.append(binfo.environment)
+    return ":".join(parts)
+
+
+def submit(jobs: JobQueue, kind: str, binfo: Union[BuildInfo, PatchInfo]) -> JobInfo:
+    try:
+        return jobs.submit(kind, binfo, dedup_key=idempotency_key(kind, binfo))
+    except QueueFull:
+        raise HTTPException(status_code=503, detail="Job queue is full")
+
+
+@router.post("/completed", status_code=202, response_model=JobInfo)
+async def build_completed(
+    binfo: BuildInfo, jobs: JobQueue = Depends(get_job_queue)
+) -> JobInfo:
     """Akcje po zbudowaniu paczki przez system CI
 
     Jeśli w komentarzu commitu znajdują się odniesienia do zgłoszeń w Jirze,
@@ -25,88 +60,280 @@ async def build_completed(binfo: BuildInfo) -> None:
     trafiło do właściwej kolejki
 
     Brane są pod uwagę tylko zmiany w gałęzi develop
+
+    Zgłoszenie jest przetwarzane asynchronicznie, stan zadania
+    dostępny jest pod /build/jobs/{id}
     """
     logger.info("request: %r", binfo)
-    # get info from Gerrit (even if there is no matching change)
-    ger = GerritClient()
-    change: Optional[ChangeInfo]
-    branches = set()
-    project_name = project_from_url(binfo.repo)
+    return submit(jobs, "build_completed", binfo)
+
+
+@router.post("/completed/batch", status_code=202, response_model=JobInfo)
+async def build_completed_batch(
+    builds: List[BuildInfo], jobs: JobQueue = Depends(get_job_queue)
+) -> JobInfo:
+    """Akcje po zbudowaniu wielu paczek przez system CI
+
+    Działa jak /build/completed, ale dane z Gerrita pobierane są raz dla
+    każdego refa, a do każdego zgłoszenia dodawany jest jeden zbiorczy
+    komentarz o wszystkich paczkach.
+    """
+    if not builds:
+        raise HTTPException(status_code=422, detail="No builds")
+    logger.info("request: %d builds", len(builds))
+    keys = sorted(idempotency_key("build_completed", binfo) for binfo in builds)
+    digest = hashlib.sha1("\n".join(keys).encode()).hexdigest()
     try:
-        change = await ger.get_change(binfo.ref)
-        branches.add(change.branch)
-        commits = await ger.change_commits(binfo.ref)
-      #  logging.info("change_commits %s", commits)
-    except NotFound:
-        change = None
-        if not binfo.repo:
-            logger.warning("Missing change and repo")
-            return
+        return jobs.submit(
+            "build_completed_batch",
+            BuildBatch(builds=builds),
+            dedup_key=f"build_completed_batch:{digest}",
+        )
+    except QueueFull:
+        raise HTTPException(status_code=503, detail="Job queue is full")
+
+
+@router.post("/patch", status_code=202, response_model=JobInfo)
+async def build_patched(
+    binfo: PatchInfo, jobs: JobQueue = Depends(get_job_queue)
+) -> JobInfo:
+    """Akcje po wdrożeniu paczki na środowisko PRE lub PROD
+
+    Zgłoszenie jest przetwarzane asynchronicznie, stan zadania
+    dostępny jest pod /build/jobs/{id}
+    """
+    logger.info("request: %r", binfo)
+    return submit(jobs, "build_patched", binfo)
+
+
+@router.get("/jobs/{job_id}", response_model=JobInfo)
+async def job_status(job_id: str, jobs: JobQueue = Depends(get_job_queue)) -> JobInfo:
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@job_queue.handler("build_completed", BuildInfo)
+async def process_build_completed(
+    binfo: BuildInfo, ger: Optional[GerritClient] = None, jira: Optional[Jira] = None
+) -> None:
+    ger = ger or get_gerrit()
+    jira = jira or get_jira()
+    project_name = project_from_url(binfo.repo)
+    with JOB_STAGES.labels("build_completed", "gerrit").time():
+        build = await resolve_build(ger, binfo.ref, project_name)
+    if build is None:
+        return
+
+    notes = BuildNotes()
+    # issue extraction is measured together with rendering
+    with JOB_STAGES.labels("build_completed", "render").time(), tracer.span(
+        "render", template="jira_build_comment.j2"
+    ):
+        await notes.add(build, [binfo], project_name)
+    with JOB_STAGES.labels("build_completed", "jira").time():
+        await notes.send(jira)
+
+
+@job_queue.handler("build_completed_batch", BuildBatch)
+async def process_build_batch(
+    batch: BuildBatch, ger: Optional[GerritClient] = None, jira: Optional[Jira] = None
+) -> None:
+    """Processes builds as one job, with single Jira comment per issue
+
+    Gerrit is asked once for every unique ref (and project). Comments about
+    all builds referencing an issue are joined into one comment.
+    """
+    ger = ger or get_gerrit()
+    jira = jira or get_jira()
+    groups: Dict[Tuple[str, str], List[BuildInfo]] = {}
+    for binfo in batch.builds:
+        key = (binfo.ref, project_from_url(binfo.repo))
+        groups.setdefault(key, []).append(binfo)
+    with JOB_STAGES.labels("build_completed_batch", "gerrit").time():
+        resolved = await asyncio.gather(
+            *(resolve_build(ger, ref, project_name) for ref, project_name in groups)
+        )
+
+    notes = BuildNotes()
+    # issue extraction is measured together with rendering
+    with JOB_STAGES.labels("build_completed_batch", "render").time(), tracer.span(
+        "render", template="jira_build_comment.j2", builds=len(batch.builds)
+    ):
+        for (_, project_name), builds, build in zip(groups, groups.values(), resolved):
+            if build is not None:
+                await notes.add(build, builds, project_name)
+    with JOB_STAGES.labels("build_completed_batch", "jira").time():
+        await notes.send(jira)
+
+
+class ResolvedBuild(NamedTuple):
+    """Source of the build and Jira keys found in its commits
+
+    `commit` is set when the build was not made from a change. Keys are not
+    filtered by known Jira projects yet.
+    """
+
+    change: Optional[ChangeSummary]
+    commit: Optional[CommitInfo]
+    issues: List[str]
+
+
+class BuildNotes:
+    """Comments and components for issues referenced by builds
+
+    Used for single build and for batch of builds alike, so both add
+    the same components and go through the same comment coalescing.
+    """
+
+    def __init__(self) -> None:
+        self.comments: Dict[str, List[str]] = {}
+        # issues by component (Gerrit project) to add
+        self.components: Dict[str, Set[str]] = {}
+
+    async def add(
+        self, build: ResolvedBuild, builds: List[BuildInfo], project_name: str
+    ) -> None:
+        """Adds comments about builds made from the same change or commit"""
+        jira_ids = issue_keys.known(build.issues)
+        for binfo in builds:
+            comment = await render(
+                "build_comment", commit=build.commit, change=build.change, build=binfo
+            )
+            for issue_id in jira_ids:
+                issue_comments = self.comments.setdefault(issue_id, [])
+                if comment not in issue_comments:
+                    issue_comments.append(comment)
+        if any(issue_id.startswith("REL-") for issue_id in jira_ids):
+            # dodanie komponentu tylko w projekcie Stabilizcja wydania
+            self.components.setdefault(project_name, set()).update(jira_ids)
+
+    async def send(self, jira: Jira) -> None:
+        """Comments issues (coalesced with other jobs) and adds components"""
+        logger.info("found issues %s", ", ".join(self.comments))
+        await jira.issues_ready_each_later(
+            {issue_id: "\n".join(texts) for issue_id, texts in self.comments.items()},
+            job_queue.defer(),
+        )
+        for project_name, issue_ids in self.components.items():
+            await jira.add_componet(
+                sorted(issue_ids),
+                project_name,
+                has_component=project_index.has_component,
+            )
+
+
+async def resolve_build(
+    ger: GerritClient, ref: str, project_name: str
+) -> Optional[ResolvedBuild]:
+    """Finds change or commit the build was made from, and its Jira keys
+
+    Returns None if neither change nor commit was found, or if the build
+    is not from develop branch. Keys of refs resolved before are taken from
+    the key index, then only the change (or commit) is fetched for
+    the comment.
+    """
+    known = key_index.get(ref)
+    if known is not None:
+        if "develop" not in known.branches:
+            return None
+        stored = change_store.get(ref)
         try:
-       #     logging.info("get_commit %s", binfo.ref)
-            commits = [await ger.get_commit(project_name, binfo.ref)]
+            if stored is not None and stored.change is not None:
+                change = stored.change
+            else:
+                # same options as resolve_change, the response is likely cached
+                lazy = await ger.get_change_lazy(ref, options=resolve_change_opts)
+                change = lazy.summary
+            return ResolvedBuild(change, None, known.issues)
         except NotFound:
-            logger.warning("No change nor commit found for %s", binfo.ref)
-            return
-        incl_nfo = await ger.get_commit_branches(project_name, binfo.ref)
-        branches = incl_nfo.branches
+            try:
+                commit = await ger.get_commit(project_name, ref)
+            except NotFound:
+                logger.warning("No change nor commit found for %s", ref)
+                return None
+            return ResolvedBuild(None, commit, known.issues)
 
-    if "develop" not in branches:
-        return
+    source = await find_source(ger, ref, project_name)
+    if source is None:
+        return None
+    issues = issue_keys.scan(commit.message for commit in source.commits)
+    remember_keys(ref, source, KeyEntry(issues, None, source.branches))
+    if "develop" not in source.branches:
+        return None
+    head = None if source.change else source.commits[0]
+    return ResolvedBuild(source.change, head, issues)
 
 
-        """
-    #breakpoint()
-    jira_ids = set()
-    for commit in commits:
-        if not commit.message:
-            continue
-        for issue_id in find_jira_issues(commit.message):
-            jira_ids.add(issue_id)
-
-        commits_p = await ger.change_commits(commit.parents[0].commit)
-        for commit_p in commits_p:
-            if not commit_p.message:
-                continue
-            logger.warning(commit_p)
-            #breakpoint()
-            for issue_id_p in find_jira_issues(commit_p.message):
-                jira_ids.add(issue_id_p)
-
-        logger.warning(commits_p)
-    breakpoint()
-    
-
-
-        """
-   # breakpoint()
-    jira_ids = set()
-    for commit in commits:
-        if not commit.message:
-            continue
-        for issue_id in find_jira_issues(commit.message):
-            jira_ids.add(issue_id)
-
-    btmpl = j2_env.get_template("jira_build_comment.j2")
-    comment = btmpl.render(commit=commits[0], change=change, build=binfo)
-    jira = Jira.from_cfg()
-    logger.info("found issues %s", ", ".join(jira_ids))
-    await jira.issues_ready(jira_ids, comment)
+async def change_source(ger: GerritClient, ref: str) -> ChangeSource:
+    """Change with its commits, raises NotFound if ref is not a change
+
+    Changes already known from Gerrit events are not looked up again.
+    """
+    stored = change_store.get(ref)
+    if stored is not None and stored.change is not None:
+        return stored
+    resolved = await ger.resolve_change(ref)
+    return ChangeSource(resolved.change, resolved.commits, {resolved.change.branch})
 
-    for issue_id in jira_ids:
-        if not issue_id.startswith("REL-"):
-            continue
-        # dodanie komponentu tylko w projekcie Stabilizcja wydania
-        await jira.add_componet(jira_ids, project_name)
+
+async def find_source(
+    ger: GerritClient, ref: str, project_name: str
+) -> Optional[ChangeSource]:
+    """Finds change or commit the build was made from
+
+    Returns None if neither change nor commit was found.
+    """
+    stored = change_store.get(ref)
+    if stored is not None:
+        return stored
+    # get info from Gerrit (even if there is no matching change)
+    try:
+        return await change_source(ger, ref)
+    except NotFound:
+        pass
+    try:
+        commit = await ger.get_commit(project_name, ref)
+    except NotFound:
+        logger.warning("No change nor commit found for %s", ref)
+        return None
+    incl_nfo = await ger.get_commit_branches(project_name, ref)
+    return ChangeSource(None, [commit], set(incl_nfo.branches))
+
+
+def remember_keys(ref: str, source: ChangeSource, entry: KeyEntry) -> None:
+    """Adds keys to the index under refs which always mean the same commits
+
+    Commit SHA is always indexed. Change number (and the ref the change was
+    found by) is indexed only when the change is merged, until then a new
+    patchset can bring other commits.
+    """
+    change = source.change
+    if change is not None:
+        refs = [change.current_revision]
+        if change.status == ChangeStatus.MERGED:
+            refs += [ref, str(change.number)]
+    elif "develop" in source.branches:
+        refs = [source.commits[0].commit]
+    else:
+        # commit can be merged to develop later
+        return
+    key_index.add(refs, entry)
 
 
 def project_from_url(url: GitUrl) -> str:
     """Finds Gerrit project name in repository URL
 
-    HTTP access method is usually used with authentication, so we take parts
+    Project is looked up in index of Gerrit projects first. If the index
+    is not loaded yet or does not know the project, we guess: HTTP access
+    method is usually used with authentication, so we take parts
     after "/a/". In other case we assume this is ssh:// and take whole path.
     This could have problems with anonymous HTTP and path with prefix.
     """
+    indexed = project_index.project_from_url(url)
+    if indexed:
+        return indexed
     assert url.path
     path = url.path.rstrip("/")
     path_parts = re.split("/a/", path, maxsplit=1)
@@ -115,64 +342,43 @@ def project_from_url(url: GitUrl) -> str:
     return path_parts[-1]
 
 
-def find_jira_issues(msg: str) -> List[str]:
-    re_issue = re.compile(r"([A-Z]{2,8}-\d+)")
-    return re_issue.findall(msg)
-
-@router.post("/patch")
-async def build_patched(binfo: PatchInfo) -> None:
-    logger.info("request: %r", binfo)
-    ger = GerritClient()
-    change: Optional[ChangeInfo]
-    branches = set()
-    jira = Jira.from_cfg()
+@job_queue.handler("build_patched", PatchInfo)
+async def process_build_patched(
+    binfo: PatchInfo, ger: Optional[GerritClient] = None, jira: Optional[Jira] = None
+) -> None:
+    ger = ger or get_gerrit()
+    jira = jira or get_jira()
 
-    try:
-        change = await ger.get_change(binfo.ref)
-        branches.add(change.branch)
-        commits = await ger.change_commits(binfo.ref)
-    except NotFound:
-        change = None
-        if not binfo.repo:
-            logger.warning("Missing change and repo")
+    known = key_index.get(binfo.ref)
+    if known is None or known.parent_issues is None:
+        try:
+            with JOB_STAGES.labels("build_patched", "gerrit").time():
+                source = await change_source(ger, binfo.ref)
+                parents = await parent_commits(ger, source.commits)
+        except NotFound:
+            if not binfo.repo:
+                logger.warning("Missing change and repo")
             return
-    if "develop" not in branches:
-        return    
-    jira_ids = set()
-    for commit in commits:
-        if not commit.message:
-            continue
-        for issue_id in find_jira_issues(commit.message):
-            jira_ids.add(issue_id)
-        
-        commits_p = await ger.change_commits(commit.parents[0].commit)
-        for commit_p in commits_p:
-            if not commit_p.message:
-                continue
-            for issue_id_p in find_jira_issues(commit_p.message):
-                jira_ids.add(issue_id_p)
-            logger.info("found issues %s", ", ".join(jira_ids))
-
-    if binfo.environment =='PRE':
-        comment = "wdrożone na $PreProdukcyjne"
-        for issue_id in jira_ids:
-            if not issue_id.startswith("REL-"):
-                continue
-            await jira.add_comment_to_ticket(jira_ids, comment)
-    
-    if binfo.environment =='PROD':
-        comment = "wdrożone na $Produkcyjne"
-        for issue_id in jira_ids:
-            if not issue_id.startswith("REL-"):
-                continue
-        await jira.issues_ready(jira_ids, comment)
-
-
-
+        with JOB_STAGES.labels("build_patched", "issues").time():
+            issues = issue_keys.scan(commit.message for commit in source.commits)
+            parent_issues = [
+                key
+                for key in issue_keys.scan(commit.message for commit in parents)
+                if key not in issues
+            ]
+        known = KeyEntry(issues, parent_issues, source.branches)
+        remember_keys(binfo.ref, source, known)
+    if "develop" not in known.branches:
+        return
+    jira_ids = issue_keys.known(known.issues + (known.parent_issues or []))
+    logger.info("found issues %s", ", ".join(jira_ids))
 
+    has_rel = any(issue_id.startswith("REL-") for issue_id in jira_ids)
+    with JOB_STAGES.labels("build_patched", "jira").time():
+        if binfo.environment == "PRE" and has_rel:
+            comment = await render("deploy_pre_comment", build=binfo)
+            await jira.add_comment_to_ticket(jira_ids, comment)
 
-    # po wywołaniu posta w jenkins należy znależć w gerrit paczke 
-    
-    #  
-    # ostani krok zmiana stausu ticketu 
-   # await jira.issues_ready(jira_ids, comment)
+        if binfo.environment == "PROD":
+            comment = await render("deploy_prod_comment", build=binfo)
+            await jira.issues_ready_later(jira_ids, comment, job_queue.defer())
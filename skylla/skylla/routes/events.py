@@ -0,0 +1,50 @@
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+
+from ..clients.gerrit import GerritClient, get_gerrit
+from ..lib.changestore import change_store
+from ..lib.jobs import JobQueue, QueueFull, get_job_queue, job_queue
+from ..models.events import GerritEvent
+from ..models.jobs import JobInfo
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+def event_key(event: GerritEvent) -> str:
+    """Key identifying repeated deliveries of the same event"""
+    parts = [event.type]
+    if event.change:
+        parts.append(str(event.change.number))
+    if event.patch_set:
+        parts.append(str(event.patch_set.number))
+    if event.ref_update:
+        parts += [event.ref_update.ref_name, event.ref_update.new_rev]
+    elif event.new_rev:
+        parts.append(event.new_rev)
+    return ":".join(parts)
+
+
+@router.post("/events", status_code=202, response_model=JobInfo)
+async def gerrit_event(
+    event: GerritEvent, jobs: JobQueue = Depends(get_job_queue)
+) -> JobInfo:
+    """Receives events from Gerrit webhooks plugin
+
+    Merged changes are fetched from Gerrit and stored, so builds of them
+    are processed without asking Gerrit again.
+    """
+    logger.debug("event: %r", event)
+    try:
+        return jobs.submit("gerrit_event", event, dedup_key=event_key(event))
+    except QueueFull:
+        raise HTTPException(status_code=503, detail="Job queue is full")
+
+
+@job_queue.handler("gerrit_event", GerritEvent)
+async def process_gerrit_event(
+    event: GerritEvent, ger: Optional[GerritClient] = None
+) -> None:
+    await change_store.ingest(ger or get_gerrit(), event)
@@ -1,32 +1,126 @@
 import os
-from typing import Optional
+from typing import Dict, List, Optional
 
 from piny import PydanticValidator  # type: ignore
 from piny import StrictMatcher, YamlLoader
 from pydantic import BaseModel, HttpUrl
 
 
+class HttpPoolConfig(BaseModel):
+    max_connections: int = 20
+    max_keepalive: int = 10
+    keepalive_expiry: float = 60.0
+    http2: bool = False
+    timeout: float = 10.0
+
+
+class ResilienceConfig(BaseModel):
+    # requests per second, 0 disables rate limit
+    rate: float = 0.0
+    burst: int = 10
+    retries: int = 3
+    backoff: float = 0.5
+    max_backoff: float = 30.0
+    # consecutive failures opening the circuit, 0 disables circuit breaker
+    failure_threshold: int = 5
+    reset_timeout: float = 30.0
+
+
+class GerritCacheConfig(BaseModel):
+    max_bytes: int = 16 * 1024 * 1024
+    # parsed mergelists are cached separately
+    max_mergelist_commits: int = 10000
+    # seconds, per endpoint, 0 disables caching
+    ttl: Dict[str, float] = {
+        "change": 30,
+        "mergelist": 86400,
+        "commit": 86400,
+        "commit_in": 300,
+        "project": 3600,
+    }
+
+
 class GerritConfig(BaseModel):
     url: HttpUrl
     user: str
     password: str
+    pool: HttpPoolConfig = HttpPoolConfig()
+    cache: GerritCacheConfig = GerritCacheConfig()
+    max_parallel: int = 8
+    resilience: ResilienceConfig = ResilienceConfig(rate=50.0, burst=50)
 
 
 class JiraConfig(BaseModel):
     url: HttpUrl
     user: str
     password: str
+    max_workers: int = 8
+    max_parallel: int = 4
+    timeout: float = 30.0
+    # seconds for which comments to the same issue are merged, 0 disables
+    coalesce_window: float = 10.0
+    cache_size: int = 10000
+    status_ttl: float = 300.0
+    transition_ttl: float = 3600.0
+    resilience: ResilienceConfig = ResilienceConfig(rate=10.0, burst=10)
 
 
 class SentryConfig(BaseModel):
     dsn: Optional[str] = None
 
 
+class QueueConfig(BaseModel):
+    workers: int = 4
+    max_depth: int = 1000
+    keep_finished: int = 1000
+    # ":memory:" keeps jobs only until restart
+    db_path: str = "skylla-jobs.db"
+    commit_interval: float = 1.0
+    retention: float = 86400.0
+    compact_interval: float = 3600.0
+    dedup_ttl: float = 3600.0
+    dedup_max: int = 10000
+
+
+class IndexConfig(BaseModel):
+    refresh_interval: float = 900.0
+    jira_projects: List[str] = ["REL"]
+
+
+class KeyIndexConfig(BaseModel):
+    # ":memory:" keeps the index only until restart
+    db_path: str = "skylla-keys.db"
+    max_entries: int = 100000
+
+
+class EventsConfig(BaseModel):
+    # accept Gerrit events on /gerrit/events
+    enabled: bool = False
+    branches: List[str] = ["develop"]
+    store_size: int = 10000
+    ttl: float = 7 * 86400.0
+
+
+class TracingConfig(BaseModel):
+    # fraction of traces recorded, 0 disables tracing
+    sample_rate: float = 0.0
+    # "file", "otlp" or empty (spans are not exported)
+    exporter: str = ""
+    file_path: str = "skylla-traces.jsonl"
+    otlp_endpoint: str = "http://localhost:4318/v1/traces"
+    service: str = "skylla"
+
+
 class Settings(BaseModel):
     gerrit: GerritConfig
     jira: JiraConfig
     sentry: SentryConfig
     ca_certs: str
+    queue: QueueConfig = QueueConfig()
+    index: IndexConfig = IndexConfig()
+    key_index: KeyIndexConfig = KeyIndexConfig()
+    tracing: TracingConfig = TracingConfig()
+    events: EventsConfig = EventsConfig()
 
 
 cfg = YamlLoader(
@@ -7,3 +7,11 @@ import pydantic
 def mock_services(monkeypatch):
     monkeypatch.setenv("SKYLLA_CONFIG", os.path.join(os.path.dirname(__file__), 'skylla-test.conf'))
     monkeypatch.setattr(pydantic, 'HttpUrl', pydantic.AnyUrl)
+
+
+@pytest.fixture(autouse=True)
+def clear_key_index(mock_services):
+    yield
+    from skylla.lib.keyindex import key_index
+
+    key_index.clear()
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from tests.mocks.gerrit.fake import fake_sha, get_fake_gerrit_client
+
+
+def test_endpoint_name():
+    from skylla.clients.gerrit import endpoint_name
+
+    sha = fake_sha("x")
+    assert endpoint_name(("changes", "1234")) == "change"
+    assert endpoint_name(("changes", "1234", "revisions", sha, "mergelist")) == (
+        "mergelist"
+    )
+    assert endpoint_name(("projects", "infra%2Fskylla", "commits", sha)) == "commit"
+    assert endpoint_name(("projects", "p", "commits", sha, "in")) == "commit_in"
+    assert endpoint_name(("projects", "p", "commits", "develop")) == "commit_by_ref"
+    assert endpoint_name(("projects/",)) == "projects"
+
+
+@pytest.mark.asyncio
+async def test_cached_commit():
+    ger = get_fake_gerrit_client()
+    commit = ger.fake.fake_commit("infra/skylla", "REL-1 zmiana")
+    for _ in range(3):
+        found = await ger.get_commit("infra/skylla", commit["commit"])
+        assert found.commit == commit["commit"]
+    assert len(ger.fake.requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_single_flight():
+    ger = get_fake_gerrit_client()
+    ger.fake.fake_change(1234, "REL-100 poprawka")
+    changes = await asyncio.gather(*(ger.get_change("1234") for _ in range(5)))
+    assert {change.number for change in changes} == {1234}
+    assert len(ger.fake.requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_not_found_not_cached():
+    from skylla.clients.gerrit import NotFound
+
+    ger = get_fake_gerrit_client()
+    with pytest.raises(NotFound):
+        await ger.get_change("1234")
+    ger.fake.fake_change(1234, "REL-100 poprawka")
+    change = await ger.get_change("1234")
+    assert change.number == 1234
@@ -0,0 +1,125 @@
+import pytest
+
+from tests.mocks.gerrit.fake import get_fake_gerrit_client
+
+
+@pytest.mark.asyncio
+async def test_get_change():
+    ger = get_fake_gerrit_client()
+    ger.fake.fake_change(1234, "REL-100 poprawka")
+    change = await ger.get_change("1234")
+    assert change.number == 1234
+    assert change.branch == "develop"
+    assert change.current_rev.commit.message == "REL-100 poprawka"
+    await ger.aclose()
+
+
+@pytest.mark.asyncio
+async def test_shared_client():
+    from skylla.clients.gerrit import close_gerrit, get_gerrit, open_gerrit
+
+    await open_gerrit()
+    ger = get_gerrit()
+    assert get_gerrit() is ger
+    await close_gerrit()
+    assert get_gerrit() is not ger
+    await close_gerrit()
+
+
+@pytest.mark.asyncio
+async def test_stream_projects():
+    ger = get_fake_gerrit_client()
+    for name in ("infra/skylla", "infra/zuul", "app/web"):
+        ger.fake.fake_project(name)
+    names = [name async for name, _ in ger.stream_projects(prefix="infra/")]
+    assert names == ["infra/skylla", "infra/zuul"]
+    projects = await ger.list_projects()
+    assert projects["app/web"].name == "app/web"
+
+
+@pytest.mark.asyncio
+async def test_stream_mergelist():
+    ger = get_fake_gerrit_client()
+    change = ger.fake.fake_change(2000, "Merge", mergelist=["REL-1 a", "REL-2 b"])
+    commits = ger.stream_mergelist("2000", change["current_revision"])
+    assert [commit.message async for commit in commits] == ["REL-1 a", "REL-2 b"]
+
+
+@pytest.mark.asyncio
+async def test_iter_projects():
+    ger = get_fake_gerrit_client()
+    names = [f"infra/p{num:02}" for num in range(7)]
+    for name in names + ["app/web"]:
+        ger.fake.fake_project(name)
+    found = [name async for name, _ in ger.iter_projects(prefix="infra/", page_size=3)]
+    assert found == names
+    assert len(ger.fake.requests) == 3
+
+
+@pytest.mark.asyncio
+async def test_iter_projects_stop_early():
+    ger = get_fake_gerrit_client()
+    for num in range(7):
+        ger.fake.fake_project(f"infra/p{num:02}")
+    projects = ger.iter_projects(page_size=3)
+    async for name, _ in projects:
+        break
+    await projects.aclose()
+    assert name == "infra/p00"
+
+
+@pytest.mark.asyncio
+async def test_resolve_change():
+    ger = get_fake_gerrit_client()
+    ger.fake.fake_change(1234, "REL-100 poprawka")
+    ger.fake.fake_change(2000, "Merge", mergelist=["REL-1 a", "REL-2 b"])
+
+    resolved = await ger.resolve_change("1234")
+    assert resolved.change.number == 1234
+    assert resolved.commit.message == "REL-100 poprawka"
+    assert resolved.commits == [resolved.commit]
+    assert len(ger.fake.requests) == 1
+
+    resolved = await ger.resolve_change("2000")
+    assert resolved.commit.message == "Merge"
+    assert [commit.message for commit in resolved.commits] == ["REL-1 a", "REL-2 b"]
+    assert len(ger.fake.requests) == 3
+
+
+@pytest.mark.asyncio
+async def test_get_changes_bulk():
+    from skylla.clients.gerrit import NotFound
+
+    ger = get_fake_gerrit_client()
+    changes = [ger.fake.fake_change(num, f"REL-{num}") for num in (1, 2)]
+    shas = [change["current_revision"] for change in changes]
+    refs = shas + ["3", "1"]
+
+    found = await ger.get_changes_bulk(refs)
+    assert [found[sha].summary.number for sha in shas] == [1, 2]
+    assert found["1"].summary.number == 1
+    assert isinstance(found["3"], NotFound)
+    assert len(ger.fake.requests) == 1
+
+    found = await ger.get_changes_bulk(refs, max_url=200)
+    assert len(found) == 4
+    assert len(ger.fake.requests) > 2
+
+
+@pytest.mark.asyncio
+async def test_mergelist_streamed_and_cached():
+    from skylla.clients.gerrit import load_json
+
+    ger = get_fake_gerrit_client()
+    ger.fake.fake_change(2000, "Merge", mergelist=["REL-1 a", "REL-2 b"])
+
+    first = await ger.change_commits("2000")
+    requests = len(ger.fake.requests)
+    ger.cache.clear()
+    second = await ger.change_commits("2000")
+
+    assert [commit.message for commit in second] == ["REL-1 a", "REL-2 b"]
+    assert second == first
+    # only the change, mergelist of the revision is kept parsed
+    assert len(ger.fake.requests) == requests + 1
+    assert load_json(b")]}'\n{\"a\": 1}\n") == {"a": 1}
@@ -0,0 +1,23 @@
+from tests.mocks.gerrit.fake import FakeGerrit
+
+
+def test_lazy_change():
+    import json
+
+    from skylla.models.gerrit import ChangeInfo, LazyChange
+
+    fake = FakeGerrit()
+    data = fake.fake_change(1234, "REL-100 poprawka")
+    data["messages"] = [{"id": "m1", "date": "bad date", "message": "x"}]
+    lazy = LazyChange.parse_raw(json.dumps(data))
+
+    summary = lazy.summary
+    assert summary.branch == "develop"
+    assert summary.full_number == "1234/1"
+    assert summary.url.endswith("/c/infra/skylla/+/1234/1")
+    assert summary.current_rev.commit.message == "REL-100 poprawka"
+
+    # invalid field outside of projection is not validated until needed
+    data["messages"] = []
+    assert isinstance(LazyChange(data).full, ChangeInfo)
+    assert LazyChange(data).full.url == summary.url
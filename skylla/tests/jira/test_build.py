@@ -10,9 +10,18 @@ def test_get_issues_safe():
     fj = get_fake_jira_client()
     fj.fake_issue('REL-123')
     issues = fj.get_issues_safe(["REL-123", "REL-1234"])
-    issues_list = list(issues)
-    assert len(issues_list) == 1
-    assert issues_list[0].key == "REL-123"
+    assert list(issues) == ["REL-123"]
+    assert issues["REL-123"].key == "REL-123"
+
+
+def test_get_issues_safe_single_search():
+    fj = get_fake_jira_client()
+    fj.fake_issue('REL-123')
+    fj.fake_issue('ABC-7')
+    issues = fj.get_issues_safe(["REL-123", "UTF-8", "ABC-7", "REL-123"])
+    assert list(issues) == ["REL-123", "ABC-7"]
+    # one rejected query, one successful query without missing keys
+    assert fj.data["_searches"] == [["REL-123", "ABC-7"]]
 
 
 @pytest.mark.asyncio
@@ -51,3 +60,60 @@ async def test_issues_ready_ignore_closed():
     assert rel100.fields.comment.comments[0].body == "a ku ku"
     assert rel100.fields.assignee.name == "jira_tech_gerrit"
     assert rel100.fields.status.name == "Wykonane"
+
+
+@pytest.mark.asyncio
+async def test_issues_ready_parallel_limit():
+    import threading
+    import time
+
+    from skylla.settings import cfg
+
+    fj = get_fake_jira_client()
+    keys = [f"REL-{n}" for n in range(200, 210)]
+    for key in keys:
+        fj.fake_issue(key, status_id="Do zrobienia", assignee="jira_tech_gerrit")
+    add_comment = fj.add_comment
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def slow_add_comment(issue, body):
+        with lock:
+            running.append(issue)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(issue)
+        return add_comment(issue, body)
+
+    fj.add_comment = slow_add_comment
+    await fj.issues_ready(keys, comment="a ku ku")
+
+    assert 1 < max(peak) <= cfg["jira"]["max_parallel"]
+    for key in keys:
+        issue = fj.issue(key)
+        assert issue.fields.comment.comments[0].body == "a ku ku"
+        assert issue.fields.status.name == "Gotowe"
+        assert not issue.fields.assignee
+
+
+@pytest.mark.asyncio
+async def test_issues_ready_cached_state():
+    fj = get_fake_jira_client()
+    for key in ("REL-300", "REL-301"):
+        fj.fake_issue(key, status_id="Do zrobienia", assignee="jira_tech_gerrit")
+    await fj.issues_ready(["REL-300", "REL-301"], comment="a ku ku")
+    await fj.issues_ready(["REL-300"], comment="jeszcze raz")
+
+    requests = fj.data["_requests"]
+    # one search, transitions read once for the same workflow state
+    assert requests.count(("GET", "search")) == 1
+    transitions = [req for req in requests if req[1].endswith("/transitions")]
+    assert [method for method, _ in transitions] == ["GET", "POST", "POST"]
+
+    rel300 = fj.issue("REL-300")
+    comments = [c.body for c in rel300.fields.comment.comments]
+    assert comments == ["a ku ku", "jeszcze raz"]
+    assert rel300.fields.status.name == "Gotowe"
+    assert fj.status_cache.get("REL-300").status == "10102"
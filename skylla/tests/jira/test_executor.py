@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_run_sync_in_thread_pool():
+    from skylla.clients.jira import run_sync
+
+    name = await run_sync(lambda: threading.current_thread().name)
+    assert name.startswith("jira")
+    assert name != threading.current_thread().name
+
+
+def test_client_created_without_jira(monkeypatch):
+    from tests.mocks.jira.fake import FakeJira, get_fake_jira_client
+
+    def unreachable(self):
+        raise AssertionError("Jira contacted")
+
+    monkeypatch.setattr(FakeJira, "server_info", unreachable)
+    fj = get_fake_jira_client()
+    adapter = fj._session.get_adapter("https://jira.example.com/")
+    assert adapter._pool_maxsize == 8
+
+
+def test_write_transient():
+    import jira
+    import requests
+    import urllib3
+
+    from skylla.clients.jira import transient_error, write_transient
+
+    refused = requests.ConnectionError(
+        urllib3.exceptions.MaxRetryError(
+            None, "/", urllib3.exceptions.NewConnectionError(None, "refused")
+        )
+    )
+    read_timeout = requests.ReadTimeout()
+    gateway = jira.exceptions.JIRAError(status_code=504)
+
+    assert write_transient(refused) and write_transient(requests.ConnectTimeout())
+    assert not write_transient(read_timeout) and not write_transient(gateway)
+    assert transient_error(read_timeout) and transient_error(gateway)
+
+
+@pytest.mark.asyncio
+async def test_comment_not_repeated_after_timeout():
+    import requests
+
+    from tests.mocks.jira.fake import get_fake_jira_client
+
+    fj = get_fake_jira_client()
+    fj.fake_issue("REL-1")
+    calls = []
+
+    def add_comment(*args):
+        calls.append(args)
+        raise requests.ReadTimeout()
+
+    with pytest.raises(requests.ReadTimeout):
+        await fj.call_write(add_comment, "REL-1", "komentarz")
+    assert len(calls) == 1
@@ -0,0 +1,38 @@
+def make_cache(**kw):
+    from skylla.lib.cache import TTLCache
+
+    now = [0.0]
+    params = dict(max_size=3, ttl=10, clock=lambda: now[0])
+    params.update(kw)
+    return TTLCache(**params), now
+
+
+def test_expiry():
+    cache, now = make_cache()
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=100)
+    now[0] = 50
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert len(cache) == 1
+
+
+def test_lru_eviction():
+    cache, _ = make_cache()
+    for key in "abc":
+        cache.set(key, key)
+    cache.get("a")
+    cache.set("d", "d")
+    assert "b" not in cache
+    assert [key for key in "acd" if key in cache] == ["a", "c", "d"]
+
+
+def test_size_eviction():
+    cache, _ = make_cache(max_size=10, sizeof=len)
+    cache.set("a", b"12345")
+    cache.set("b", b"12345")
+    cache.set("c", b"1")
+    assert "a" not in cache
+    assert cache.size == 6
+    cache.set("d", b"12345678901")
+    assert "d" not in cache
@@ -0,0 +1,108 @@
+import pytest
+
+from tests.mocks.gerrit.fake import get_fake_gerrit_client
+from tests.mocks.jira.fake import get_fake_jira_client
+
+
+def merged_event(change):
+    from skylla.models.events import GerritEvent
+
+    sha = change["current_revision"]
+    return GerritEvent.parse_obj(
+        {
+            "type": "change-merged",
+            "change": {
+                "project": change["project"],
+                "branch": change["branch"],
+                "id": change["change_id"],
+                "number": change["_number"],
+            },
+            "patchSet": {"number": 1, "revision": sha},
+            "newRev": sha,
+        }
+    )
+
+
+@pytest.mark.asyncio
+async def test_build_from_stored_change():
+    from skylla.lib.changestore import change_store
+    from skylla.routes.builds import process_build_completed
+    from tests.routes.test_builds import build_info
+
+    ger = get_fake_gerrit_client()
+    change = ger.fake.fake_change(4321, "REL-950 poprawka")
+    fj = get_fake_jira_client()
+    fj.fake_issue("REL-950", assignee="jira_tech_gerrit")
+    try:
+        await change_store.ingest(ger, merged_event(change))
+        fetched = len(ger.fake.requests)
+
+        await process_build_completed(
+            build_info(change["current_revision"]), ger=ger, jira=fj
+        )
+    finally:
+        change_store.entries.clear()
+
+    assert len(ger.fake.requests) == fetched
+    assert "4321/1" in fj.issue("REL-950").fields.comment.comments[0].body
+
+
+@pytest.mark.asyncio
+async def test_ingest_direct_push():
+    from skylla.lib.changestore import ChangeStore
+    from skylla.models.events import GerritEvent
+
+    ger = get_fake_gerrit_client()
+    commit = ger.fake.fake_commit("infra/skylla", "REL-951 bez review")
+    store = ChangeStore(100, 60.0, ["develop"])
+    event = {
+        "type": "ref-updated",
+        "refUpdate": {
+            "oldRev": "0" * 40,
+            "newRev": commit["commit"],
+            "refName": "refs/heads/develop",
+            "project": "infra/skylla",
+        },
+    }
+
+    await store.ingest(ger, GerritEvent.parse_obj(event))
+    event["refUpdate"]["refName"] = "refs/heads/master"
+    await store.ingest(ger, GerritEvent.parse_obj(event))
+
+    entry = store.get(commit["commit"])
+    assert entry is not None and entry.change is None
+    assert entry.branches == {"develop"}
+    assert entry.commits[0].message.startswith("REL-951")
+
+
+@pytest.mark.asyncio
+async def test_ingest_ref_update_of_change():
+    from skylla.lib.changestore import ChangeStore
+    from skylla.models.events import GerritEvent
+
+    ger = get_fake_gerrit_client()
+    change = ger.fake.fake_change(4322, "REL-952 poprawka")
+    store = ChangeStore(100, 60.0, ["develop"])
+    event = {
+        "type": "ref-updated",
+        "refUpdate": {
+            "oldRev": "0" * 40,
+            "newRev": change["current_revision"],
+            "refName": "refs/heads/develop",
+            "project": "infra/skylla",
+        },
+    }
+
+    await store.ingest(ger, GerritEvent.parse_obj(event))
+
+    entry = store.get("4322")
+    assert entry is not None and entry.change is not None
+    assert store.get(change["current_revision"]) is entry
+    assert entry.commits[0].message.startswith("REL-952")
+
+
+def test_event_payload_roundtrip():
+    from skylla.models.events import GerritEvent
+
+    event = GerritEvent.parse_obj({"type": "ref-updated", "newRev": "abc"})
+    assert GerritEvent.parse_raw(event.json()).new_rev == "abc"
@@ -0,0 +1,110 @@
+import pytest
+
+from tests.mocks.jira.fake import get_fake_jira_client
+
+
+class Writes:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, comments):
+        self.calls.append(dict(comments))
+        if getattr(self, "error", None):
+            raise self.error
+
+
+@pytest.mark.asyncio
+async def test_window():
+    from skylla.lib.coalesce import CommentCoalescer
+
+    writes = Writes()
+    done = []
+    coalescer = CommentCoalescer(writes, 0.05)
+    await coalescer.add(["REL-1", "REL-2"], "build 1", done.append)
+    await coalescer.add(["REL-1"], "build 2", done.append)
+    await coalescer.add(["REL-1"], "build 2")
+    assert writes.calls == []
+    assert done == []
+
+    await coalescer.task
+    assert writes.calls == [{"REL-1": "build 1\nbuild 2", "REL-2": "build 1"}]
+    assert done == [None, None]
+
+    await coalescer.add(["REL-1"], "build 3")
+    await coalescer.task
+    assert writes.calls[1:] == [{"REL-1": "build 3"}]
+
+
+@pytest.mark.asyncio
+async def test_write_error_passed_to_callers():
+    from skylla.lib.coalesce import CommentCoalescer
+
+    writes = Writes()
+    writes.error = RuntimeError("Jira down")
+    done = []
+    coalescer = CommentCoalescer(writes, 0.01)
+    await coalescer.add(["REL-1"], "build 1", done.append)
+    await coalescer.add(["REL-2"], "build 2", done.append)
+    await coalescer.task
+    assert [type(error) for error in done] == [RuntimeError, RuntimeError]
+
+
+@pytest.mark.asyncio
+async def test_no_issues():
+    from skylla.lib.coalesce import CommentCoalescer
+
+    writes = Writes()
+    done = []
+    coalescer = CommentCoalescer(writes, 60)
+    await coalescer.add([], "build 1", done.append)
+    assert done == [None]
+    assert coalescer.timer is None
+    assert writes.calls == []
+
+
+@pytest.mark.asyncio
+async def test_disabled():
+    from skylla.lib.coalesce import CommentCoalescer
+
+    writes = Writes()
+    coalescer = CommentCoalescer(writes, 0)
+    await coalescer.add(["REL-1"], "build 1")
+    assert writes.calls == [{"REL-1": "build 1"}]
+
+    writes.error = RuntimeError("Jira down")
+    with pytest.raises(RuntimeError):
+        await coalescer.add(["REL-1"], "build 2")
+    done = []
+    await coalescer.add(["REL-1"], "build 3", done.append)
+    assert [type(error) for error in done] == [RuntimeError]
+
+
+@pytest.mark.asyncio
+async def test_close_flushes():
+    from skylla.lib.coalesce import CommentCoalescer
+
+    writes = Writes()
+    done = []
+    coalescer = CommentCoalescer(writes, 60)
+    await coalescer.add(["REL-1"], "build 1", done.append)
+    await coalescer.close()
+    assert writes.calls == [{"REL-1": "build 1"}]
+    assert done == [None]
+    assert coalescer.timer is None
+
+
+@pytest.mark.asyncio
+async def test_issue_transitioned_once():
+    from skylla.lib.coalesce import CommentCoalescer
+
+    fj = get_fake_jira_client()
+    fj.fake_issue("REL-900", assignee="jira_tech_gerrit")
+    fj._coalescer = CommentCoalescer(fj.issues_ready_each, 60)
+    await fj.issues_ready_later(["REL-900"], "build 1")
+    await fj.issues_ready_later(["REL-900"], "build 2")
+    await fj.coalescer.close()
+
+    rel900 = fj.issue("REL-900")
+    assert [c.body for c in rel900.fields.comment.comments] == ["build 1\nbuild 2"]
+    assert rel900.fields.status.name == "Gotowe"
+    assert fj.data["_searches"] == [["REL-900"]]
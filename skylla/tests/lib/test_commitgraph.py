@@ -0,0 +1,67 @@
+import pytest
+
+from tests.mocks.gerrit.fake import get_fake_gerrit_client
+
+
+@pytest.mark.asyncio
+async def test_parent_commits():
+    from skylla.lib.commitgraph import parent_commits
+
+    ger = get_fake_gerrit_client()
+    merge = ger.fake.fake_change(2000, "Merge", mergelist=["REL-1 a", "REL-2 b"])
+    parent_sha = merge["revisions"][merge["current_revision"]]["commit"]["parents"][0]
+    ger.fake.fake_change(1999, "REL-3 parent", sha=parent_sha["commit"])
+
+    commits = await ger.change_commits("2000")
+    requests = len(ger.fake.requests)
+    parents = await parent_commits(ger, commits)
+
+    assert [commit.message for commit in parents] == ["REL-3 parent"]
+    # both merged commits have the same parent, resolved once
+    assert len(ger.fake.requests) - requests == 1
+
+
+@pytest.mark.asyncio
+async def test_parent_not_a_change():
+    from skylla.lib.commitgraph import parent_commits
+
+    ger = get_fake_gerrit_client()
+    ger.fake.fake_change(2000, "REL-1 a")
+    commits = await ger.change_commits("2000")
+    assert await parent_commits(ger, commits) == []
+
+
+@pytest.mark.asyncio
+async def test_parents_in_one_query():
+    from skylla.lib.commitgraph import parent_commits
+
+    ger = get_fake_gerrit_client()
+    commits = []
+    for num in range(10):
+        parent = ger.fake.fake_change(100 + num, f"REL-{num} parent")
+        change = ger.fake.fake_change(
+            200 + num, "child", parents=[parent["current_revision"]]
+        )
+        commits.append((await ger.resolve_change(str(change["_number"]))).commit)
+    requests = len(ger.fake.requests)
+
+    parents = await parent_commits(ger, commits)
+
+    assert [commit.message for commit in parents] == [
+        f"REL-{num} parent" for num in range(10)
+    ]
+    assert len(ger.fake.requests) - requests == 1
+
+
+@pytest.mark.asyncio
+async def test_merge_parent():
+    from skylla.lib.commitgraph import parent_commits
+
+    ger = get_fake_gerrit_client()
+    parent = ger.fake.fake_change(1999, "Merge", mergelist=["REL-1 a", "REL-2 b"])
+    ger.fake.fake_change(2000, "child", parents=[parent["current_revision"]])
+    commits = await ger.change_commits("2000")
+
+    parents = await parent_commits(ger, commits)
+
+    assert [commit.message for commit in parents] == ["REL-1 a", "REL-2 b"]
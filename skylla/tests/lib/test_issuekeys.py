@@ -0,0 +1,14 @@
+def test_find_in_order():
+    from skylla.lib.issuekeys import IssueKeyExtractor
+
+    extractor = IssueKeyExtractor()
+    messages = ["REL-2 poprawka\n\nABC-1", None, "", "REL-1 i REL-2, UTF-8"]
+    assert extractor.find(messages) == ["REL-2", "ABC-1", "REL-1", "UTF-8"]
+
+
+def test_known_projects():
+    from skylla.lib.issuekeys import IssueKeyExtractor
+
+    extractor = IssueKeyExtractor(lambda: {"REL", "ABC"})
+    messages = ["REL-900 kodowanie UTF-8, skrót SHA-256", "ABC-1"]
+    assert extractor.find(messages) == ["REL-900", "ABC-1"]
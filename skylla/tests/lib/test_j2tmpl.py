@@ -0,0 +1,12 @@
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_render_registered():
+    from skylla.lib.j2tmpl import TEMPLATES, get_template, load_templates, render
+
+    load_templates()
+    for name in TEMPLATES:
+        assert get_template(name) is get_template(name)
+    assert await render("deploy_pre_comment") == "wdrożone na $PreProdukcyjne"
+    assert await render("deploy_prod_comment") == "wdrożone na $Produkcyjne"
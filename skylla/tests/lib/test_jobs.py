@@ -0,0 +1,200 @@
+import asyncio
+
+import pytest
+from pydantic import BaseModel
+
+
+class Payload(BaseModel):
+    value: int
+
+
+def make_queue(**kw):
+    from skylla.lib.jobs import JobQueue
+    from skylla.lib.jobstore import JobStore
+
+    params = dict(workers=2, max_depth=10, keep_finished=10)
+    params.update(kw)
+    if "store" not in params:
+        params["store"] = JobStore(":memory:")
+    return JobQueue(**params)
+
+
+@pytest.mark.asyncio
+async def test_job_done():
+    from skylla.lib.jobs import JobState
+
+    jobs = make_queue()
+    seen = []
+
+    @jobs.handler("test", Payload)
+    async def handle(payload):
+        seen.append(payload.value)
+
+    await jobs.start()
+    job = jobs.submit("test", Payload(value=1))
+    assert job.state == JobState.queued
+    await jobs.queue.join()
+    assert jobs.get(job.id).state == JobState.done
+    assert seen == [1]
+    await jobs.stop()
+
+
+@pytest.mark.asyncio
+async def test_job_failed():
+    from skylla.lib.jobs import JobState
+
+    jobs = make_queue()
+
+    @jobs.handler("test", Payload)
+    async def handle(payload):
+        raise ValueError(payload.value)
+
+    await jobs.start()
+    job = jobs.submit("test", Payload(value=2))
+    await jobs.queue.join()
+    assert jobs.get(job.id).state == JobState.failed
+    assert jobs.get(job.id).error == "ValueError(2)"
+    await jobs.stop()
+
+
+@pytest.mark.asyncio
+async def test_deferred_part():
+    from skylla.lib.jobs import JobState
+
+    jobs = make_queue(workers=1)
+    completions = []
+
+    @jobs.handler("test", Payload)
+    async def handle(payload):
+        completions.append(jobs.defer())
+
+    await jobs.start()
+    first = jobs.submit("test", Payload(value=1))
+    second = jobs.submit("test", Payload(value=2))
+    # worker does not wait for deferred parts
+    await jobs.queue.join()
+    assert jobs.get(first.id).state == JobState.running
+    assert jobs.get(second.id).state == JobState.running
+    assert [job.id for job, _ in jobs.store.pending()] == [first.id, second.id]
+
+    completions[0](None)
+    completions[1](ValueError(2))
+    assert jobs.get(first.id).state == JobState.done
+    assert jobs.get(second.id).state == JobState.failed
+    assert jobs.get(second.id).error == "ValueError(2)"
+    assert jobs.defer() is None
+    await jobs.stop()
+
+
+@pytest.mark.asyncio
+async def test_queue_full():
+    from skylla.lib.jobs import QueueFull
+
+    jobs = make_queue(workers=1, max_depth=1)
+    release = asyncio.Event()
+
+    @jobs.handler("test", Payload)
+    async def handle(payload):
+        await release.wait()
+
+    await jobs.start()
+    jobs.submit("test", Payload(value=1))
+    await asyncio.sleep(0)
+    jobs.submit("test", Payload(value=2))
+    with pytest.raises(QueueFull):
+        jobs.submit("test", Payload(value=3))
+    release.set()
+    await jobs.queue.join()
+    await jobs.stop()
+
+
+@pytest.mark.asyncio
+async def test_replay_after_restart(tmp_path):
+    from skylla.lib.jobs import JobState
+    from skylla.lib.jobstore import JobStore
+
+    db_path = str(tmp_path / "jobs.db")
+    seen = []
+
+    # no workers, job stays queued until shutdown
+    jobs = make_queue(workers=0, store=JobStore(db_path))
+    jobs.handler("test", Payload)(None)
+    await jobs.start()
+    job = jobs.submit("test", Payload(value=7))
+    await jobs.stop()
+    jobs.store.close()
+
+    jobs = make_queue(store=JobStore(db_path))
+
+    @jobs.handler("test", Payload)
+    async def handle(payload):
+        seen.append(payload.value)
+
+    await jobs.start()
+    await jobs.queue.join()
+    await jobs.stop()
+    assert seen == [7]
+    assert jobs.store.get(job.id).state == JobState.done
+    assert jobs.store.pending() == []
+
+
+@pytest.mark.asyncio
+async def test_compact():
+    from datetime import datetime
+
+    jobs = make_queue(keep_finished=0)
+
+    @jobs.handler("test", Payload)
+    async def handle(payload):
+        pass
+
+    await jobs.start()
+    job = jobs.submit("test", Payload(value=1))
+    await jobs.queue.join()
+    await jobs.stop()
+    assert jobs.get(job.id) is not None
+    assert jobs.store.compact(datetime.utcnow()) == 1
+    assert jobs.get(job.id) is None
+
+
+@pytest.mark.asyncio
+async def test_duplicates():
+    jobs = make_queue()
+    seen = []
+
+    @jobs.handler("test", Payload)
+    async def handle(payload):
+        seen.append(payload.value)
+
+    await jobs.start()
+    job = jobs.submit("test", Payload(value=1), dedup_key="a")
+    assert jobs.submit("test", Payload(value=1), dedup_key="a").id == job.id
+    await jobs.queue.join()
+    assert jobs.submit("test", Payload(value=1), dedup_key="a").id == job.id
+    assert jobs.submit("test", Payload(value=2), dedup_key="b").id != job.id
+    await jobs.queue.join()
+    await jobs.stop()
+    assert seen == [1, 2]
+
+    # new queue (after restart) finds duplicates in the store
+    restarted = make_queue(store=jobs.store)
+    restarted.handlers = jobs.handlers
+    await restarted.start()
+    assert restarted.submit("test", Payload(value=1), dedup_key="a").id == job.id
+    await restarted.stop()
+
+
+@pytest.mark.asyncio
+async def test_failed_not_duplicate():
+    jobs = make_queue()
+
+    @jobs.handler("test", Payload)
+    async def handle(payload):
+        raise ValueError(payload.value)
+
+    await jobs.start()
+    job = jobs.submit("test", Payload(value=1), dedup_key="a")
+    await jobs.queue.join()
+    assert jobs.submit("test", Payload(value=1), dedup_key="a").id != job.id
+    await jobs.queue.join()
+    await jobs.stop()
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+DOCS = [
+    [{"commit": "a" * 40, "message": "REL-1 zażółć"}, 12345, "x", True, None, []],
+    {"infra/skylla": {"id": "infra%2Fskylla"}, "b": 1.5, "c": [1, {"d": "}"}]},
+    [],
+    {},
+]
+
+
+def decode_chunked(raw, size, skip=0):
+    from skylla.lib.jsonstream import JSONStreamDecoder
+
+    decoder = JSONStreamDecoder(skip=skip)
+    items = []
+    for start in range(0, len(raw), size):
+        items.extend(decoder.feed(raw[start : start + size]))
+    items.extend(decoder.close())
+    return items
+
+
+@pytest.mark.parametrize("doc", DOCS)
+@pytest.mark.parametrize("size", [1, 2, 7, 1000])
+def test_chunked(doc, size):
+    raw = b")]}'\n" + json.dumps(doc, indent=1, ensure_ascii=False).encode()
+    items = decode_chunked(raw, size, skip=5)
+    if isinstance(doc, dict):
+        assert dict(items) == doc
+    else:
+        assert items == doc
+
+
+def test_incomplete():
+    from skylla.lib.jsonstream import JSONStreamDecoder
+
+    decoder = JSONStreamDecoder()
+    assert decoder.feed(b'[1, 2, {"a"') == [1, 2]
+    with pytest.raises(ValueError):
+        decoder.close()
@@ -0,0 +1,69 @@
+def test_add_get():
+    from skylla.lib.keyindex import KeyEntry, KeyIndex
+
+    index = KeyIndex(":memory:", 10)
+    index.add(["1234", "abc", None, "1234"], KeyEntry(["REL-1"], None, {"develop"}))
+
+    assert index.get("1234") == KeyEntry(["REL-1"], None, {"develop"})
+    assert index.get("abc") == index.get("1234")
+    assert index.get("1235") is None
+    assert index.count == 2
+
+    index.add(["abc"], KeyEntry(["REL-1"], [], {"develop"}))
+    assert index.get("abc").parent_issues == []
+    assert index.count == 2
+
+
+def test_prune_least_recently_used():
+    from skylla.lib.keyindex import KeyEntry, KeyIndex
+
+    now = [0.0]
+    index = KeyIndex(":memory:", 2, clock=lambda: now[0])
+    entry = KeyEntry([], None, {"develop"})
+    for ref in ("a", "b"):
+        now[0] += 1
+        index.add([ref], entry)
+    now[0] += 1
+    index.get("a")
+    index.add(["c"], entry)
+
+    assert index.get("b") is None
+    assert index.get("a") and index.get("c")
+    assert index.count == 2
+
+
+def test_persistent(tmp_path):
+    from skylla.lib.keyindex import KeyEntry, KeyIndex
+
+    path = str(tmp_path / "keys.db")
+    index = KeyIndex(path, 10)
+    index.add(["1234"], KeyEntry(["REL-1", "ABC-2"], ["REL-3"], {"develop"}))
+    index.close()
+
+    index = KeyIndex(path, 10)
+    assert index.count == 1
+    assert index.get("1234") == KeyEntry(["REL-1", "ABC-2"], ["REL-3"], {"develop"})
+
+
+def test_use_written_with_next_add(tmp_path):
+    from skylla.lib.keyindex import KeyEntry, KeyIndex
+
+    now = [1.0]
+    path = str(tmp_path / "keys.db")
+    index = KeyIndex(path, 10, clock=lambda: now[0])
+    index.add(["a", "b"], KeyEntry([], None, {"develop"}))
+    now[0] = 2.0
+    index.get("a")
+
+    def used():
+        return dict(index.db.execute("SELECT ref, used FROM commit_keys"))
+
+    assert used() == {"a": 1.0, "b": 1.0}
+    index.add(["c"], KeyEntry([], None, {"develop"}))
+    assert used() == {"a": 2.0, "b": 1.0, "c": 2.0}
+    now[0] = 3.0
+    index.get("b")
+    index.close()
+
+    index = KeyIndex(path, 10)
+    assert used()["b"] == 3.0
@@ -0,0 +1,55 @@
+import pytest
+from prometheus_client import REGISTRY
+
+from tests.mocks.gerrit.fake import get_fake_gerrit_client
+from tests.mocks.jira.fake import get_fake_jira_client
+
+
+def requests_count(upstream, endpoint, method, status):
+    labels = {
+        "upstream": upstream,
+        "endpoint": endpoint,
+        "method": method,
+        "status": status,
+    }
+    value = REGISTRY.get_sample_value(
+        "skylla_upstream_request_duration_seconds_count", labels
+    )
+    return value or 0
+
+
+def test_endpoint_template():
+    from skylla.clients.jira import endpoint_template
+
+    cases = {
+        "/rest/api/2/issue/REL-900/comment": "issue/{id}/comment",
+        "/jira/rest/api/2/search?jql=x": "search",
+        "/rest/api/2/project/REL/components": "project/{id}/components",
+    }
+    for path, template in cases.items():
+        assert endpoint_template(path) == template
+
+
+def test_request_timer_error():
+    from skylla.lib.metrics import RequestTimer
+
+    before = requests_count("test", "thing", "GET", "KeyError")
+    with pytest.raises(KeyError):
+        with RequestTimer("test", "thing"):
+            raise KeyError()
+    assert requests_count("test", "thing", "GET", "KeyError") == before + 1
+
+
+@pytest.mark.asyncio
+async def test_upstream_requests():
+    ger = get_fake_gerrit_client()
+    ger.fake.fake_project("infra/skylla")
+    before = requests_count("gerrit", "project", "GET", "200")
+    await ger.get_project("infra/skylla")
+    assert requests_count("gerrit", "project", "GET", "200") == before + 1
+
+    fj = get_fake_jira_client()
+    fj.fake_issue("REL-900")
+    before = requests_count("jira", "issue/{id}/comment", "POST", "201")
+    await fj.call(fj.add_comment, "REL-900", "a ku ku")
+    assert requests_count("jira", "issue/{id}/comment", "POST", "201") == before + 1
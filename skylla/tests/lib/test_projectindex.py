@@ -0,0 +1,78 @@
+import pytest
+from pydantic import parse_obj_as
+
+from tests.mocks.gerrit.fake import get_fake_gerrit_client
+from tests.mocks.jira.fake import get_fake_jira_client
+
+
+def git_url(url):
+    from skylla.models.git import GitUrl
+
+    return parse_obj_as(GitUrl, url)
+
+
+def test_project_from_url():
+    from skylla.lib.projectindex import ProjectIndex
+
+    index = ProjectIndex(["REL"], 900.0)
+    assert index.project_from_url(git_url("https://gerrit/a/infra/skylla")) is None
+
+    index.projects = {"infra/skylla", "skylla"}
+    for url in (
+        "https://gerrit/a/infra/skylla",
+        "https://gerrit/infra/skylla.git",
+        "https://host/gerrit/a/infra/skylla/",
+        "ssh://jenkins@gerrit:29418/infra/skylla",
+    ):
+        assert index.project_from_url(git_url(url)) == "infra/skylla", url
+    assert index.project_from_url(git_url("https://gerrit/a/other")) is None
+
+
+def test_has_component():
+    from skylla.lib.projectindex import ProjectIndex
+
+    index = ProjectIndex(["REL"], 900.0)
+    assert index.has_component("REL", "infra/skylla") is None
+    index.components = {"REL": {"infra/skylla"}}
+    assert index.has_component("REL", "infra/skylla") is True
+    assert index.has_component("REL", "infra/zuul") is False
+    assert index.has_component("ABC", "infra/skylla") is None
+
+
+@pytest.mark.asyncio
+async def test_refresh():
+    from skylla.lib.projectindex import ProjectIndex
+
+    ger = get_fake_gerrit_client()
+    ger.fake.fake_project("infra/skylla")
+    ger.fake.fake_project("infra/zuul")
+    fj = get_fake_jira_client()
+    fj.fake_project("REL")
+    fj.fake_component("REL", "infra/skylla")
+
+    index = ProjectIndex(["REL"], 900.0)
+    await index.refresh(ger, fj)
+
+    assert index.projects == {"infra/skylla", "infra/zuul"}
+    assert index.components == {"REL": {"infra/skylla"}}
+    assert index.known_jira_projects() == {"REL"}
+    assert index.refreshed
+
+
+@pytest.mark.asyncio
+async def test_add_component_unknown():
+    fj = get_fake_jira_client()
+    fj.fake_issue("REL-900")
+    components = {"REL": {"infra/zuul"}}
+
+    def has_component(project, name):
+        return name in components[project] if project in components else None
+
+    await fj.add_componet(["REL-900"], "infra/skylla", has_component=has_component)
+    assert not fj.issue("REL-900").fields.components
+    # no search for issues which can't get the component
+    assert "_searches" not in fj.data
+
+    await fj.add_componet(["REL-900"], "infra/zuul", has_component=has_component)
+    cnames = tuple(c.name for c in fj.issue("REL-900").fields.components)
+    assert cnames == ("infra/zuul",)
@@ -0,0 +1,116 @@
+import pytest
+
+from tests.mocks.gerrit.fake import get_fake_gerrit_client
+
+
+class Flaky:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+class Transient(Exception):
+    pass
+
+
+def upstream(**kw):
+    from skylla.lib.resilience import Upstream
+
+    return Upstream(
+        "test",
+        transient=lambda exc: isinstance(exc, Transient),
+        retry_after=lambda exc: 0.0,
+        **kw,
+    )
+
+
+def test_parse_retry_after():
+    from skylla.lib.resilience import parse_retry_after
+
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
+
+
+@pytest.mark.asyncio
+async def test_retry():
+    func = Flaky([Transient(), Transient()])
+    assert await upstream(retries=3).call(func) == "ok"
+    assert func.calls == 3
+
+    func = Flaky([Transient(), Transient()])
+    with pytest.raises(Transient):
+        await upstream(retries=1).call(func)
+    assert func.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_no_retry_of_other_errors():
+    func = Flaky([KeyError()])
+    with pytest.raises(KeyError):
+        await upstream().call(func)
+    assert func.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker():
+    from skylla.lib.resilience import CircuitOpen
+
+    up = upstream(retries=0, failure_threshold=2, reset_timeout=60)
+    func = Flaky([Transient(), Transient()])
+    for _ in range(2):
+        with pytest.raises(Transient):
+            await up.call(func)
+    with pytest.raises(CircuitOpen):
+        await up.call(func)
+    assert func.calls == 2
+
+    # after reset timeout one probe closes the circuit
+    up.breaker.opened -= 60
+    assert await up.call(func) == "ok"
+    assert up.breaker.state == up.breaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_transient_override_does_not_hide_failures():
+    up = upstream(failure_threshold=2)
+    for _ in range(2):
+        func = Flaky([Transient()])
+        with pytest.raises(Transient):
+            await up.call(func, transient=lambda exc: False)
+        assert func.calls == 1
+    assert up.breaker.state == up.breaker.OPEN
+
+
+@pytest.mark.asyncio
+async def test_token_bucket():
+    from skylla.lib.resilience import TokenBucket
+
+    now = [0.0]
+    bucket = TokenBucket(rate=10, burst=2, clock=lambda: now[0])
+    await bucket.acquire()
+    await bucket.acquire()
+    assert bucket.tokens < 1
+    now[0] += 0.1
+    await bucket.acquire()
+
+
+@pytest.mark.asyncio
+async def test_gerrit_retries_unavailable():
+    ger = get_fake_gerrit_client()
+    ger.fake.fake_project("infra/skylla")
+    ger.fake.failures = [503, 429]
+    project = await ger.get_project("infra/skylla")
+    assert project.name == "infra/skylla"
+    assert len(ger.fake.requests) == 3
+
+    ger.fake.failures = [503]
+    projects = [name async for name, _ in ger.stream_projects()]
+    assert projects == ["infra/skylla"]
@@ -0,0 +1,179 @@
+import json
+
+import httpx
+import pytest
+
+from tests.lib.test_jobs import Payload, make_queue
+from tests.mocks.gerrit.fake import get_fake_gerrit_client
+
+
+class Collector:
+    """Stand-in OTLP collector, keeps received spans"""
+
+    def __init__(self):
+        self.spans = []
+
+    async def __call__(self, scope, receive, send):
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        for resource in json.loads(body)["resourceSpans"]:
+            for scope_spans in resource["scopeSpans"]:
+                self.spans.extend(scope_spans["spans"])
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+
+@pytest.fixture
+def collector():
+    from skylla.lib.tracing import OTLPExporter, tracer
+
+    collector = Collector()
+    client = httpx.AsyncClient(app=collector)
+    exporter = OTLPExporter("http://collector/v1/traces", client=client)
+    saved = tracer.sample_rate, tracer.exporter
+    tracer.sample_rate, tracer.exporter = 1.0, exporter
+    yield collector
+    tracer.sample_rate, tracer.exporter = saved
+
+
+def test_traceparent():
+    from skylla.lib.tracing import SpanContext, format_traceparent, parse_traceparent
+
+    header = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+    context = parse_traceparent(header)
+    assert context == SpanContext(
+        "0af7651916cd43dd8448eb211c80319c", "b7ad6b7169203331", True
+    )
+    assert format_traceparent(context) == header
+    assert parse_traceparent("garbage") is None
+
+
+def test_not_sampled():
+    from skylla.lib.tracing import Tracer
+
+    exported = []
+
+    class Memory:
+        def export(self, spans):
+            exported.extend(spans)
+
+    tracer = Tracer(0.0, Memory())
+    with tracer.span("root"):
+        with tracer.span("child"):
+            pass
+    assert exported == []
+
+    tracer.sample_rate = 1.0
+    with tracer.span("root") as root:
+        with tracer.span("child") as child:
+            pass
+    assert exported == [child, root]
+    assert child.parent_id == root.context.span_id
+    assert child.context.trace_id == root.context.trace_id
+
+
+@pytest.mark.asyncio
+async def test_job_continues_trace(collector):
+    from skylla.lib.tracing import tracer
+
+    ger = get_fake_gerrit_client()
+    ger.fake.fake_project("infra/skylla")
+    jobs = make_queue()
+
+    @jobs.handler("test", Payload)
+    async def handle(payload):
+        await ger.get_project("infra/skylla")
+
+    await jobs.start()
+    with tracer.span("POST /build/completed", kind="server") as request:
+        jobs.submit("test", Payload(value=1))
+    await jobs.queue.join()
+    await jobs.stop()
+    await tracer.exporter.shutdown()
+
+    by_name = {span["name"]: span for span in collector.spans}
+    assert set(by_name) == {"POST /build/completed", "job test", "gerrit GET"}
+    trace_ids = {span["traceId"] for span in collector.spans}
+    assert trace_ids == {request.context.trace_id}
+    assert by_name["job test"]["parentSpanId"] == request.context.span_id
+    assert by_name["gerrit GET"]["parentSpanId"] == by_name["job test"]["spanId"]
+
+
+@pytest.mark.asyncio
+async def test_middleware(collector):
+    from skylla.lib.tracing import TracingMiddleware, tracer
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 202, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    traceparent = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+    async with httpx.AsyncClient(app=TracingMiddleware(app)) as client:
+        headers = {"traceparent": traceparent}
+        await client.post("http://skylla/build/patch", headers=headers)
+    await tracer.exporter.shutdown()
+
+    [span] = collector.spans
+    assert span["name"] == "POST /build/patch"
+    assert span["traceId"] == "0af7651916cd43dd8448eb211c80319c"
+    assert span["parentSpanId"] == "b7ad6b7169203331"
+    status = {"key": "http.status_code", "value": {"intValue": "202"}}
+    assert status in span["attributes"]
+
+
+@pytest.mark.asyncio
+async def test_sentry_tag_per_trace():
+    import asyncio
+
+    import sentry_sdk
+
+    from skylla.lib.tracing import Tracer
+
+    events = []
+    tracer = Tracer(1.0)
+
+    async def request(name):
+        with tracer.span(name) as span:
+            await asyncio.sleep(0)
+            sentry_sdk.capture_message(name)
+            return span.context.trace_id
+
+    with sentry_sdk.Hub(sentry_sdk.Client(transport=events.append)):
+        trace_ids = await asyncio.gather(request("a"), request("b"))
+        sentry_sdk.capture_message("later")
+        sentry_sdk.flush()
+
+    tags = {event["message"]: event.get("tags", {}) for event in events}
+    assert tags["a"]["trace_id"] == trace_ids[0]
+    assert tags["b"]["trace_id"] == trace_ids[1]
+    assert "trace_id" not in tags["later"]
+
+
+@pytest.mark.asyncio
+async def test_file_exporter(tmp_path):
+    from skylla.lib.tracing import FileExporter, Tracer
+
+    path = tmp_path / "traces.jsonl"
+    tracer = Tracer(1.0, FileExporter(str(path)))
+    with tracer.span("root"):
+        with tracer.span("child"):
+            pass
+    await tracer.shutdown()
+
+    names = [json.loads(line)["name"] for line in path.read_text().splitlines()]
+    assert names == ["child", "root"]
+
+
+def test_exporter_path_resolved(tmp_path, monkeypatch):
+    from skylla.lib.tracing import Exporter, FileExporter
+
+    monkeypatch.chdir(tmp_path)
+    exporter = FileExporter("traces.jsonl")
+    assert exporter.path == str(tmp_path / "traces.jsonl")
+    exporter.executor.shutdown()
+    with pytest.raises(TypeError):
+        Exporter()
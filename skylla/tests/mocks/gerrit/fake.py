@@ -0,0 +1,242 @@
+import hashlib
+import json
+import logging
+import re
+from urllib.parse import parse_qs, unquote
+
+logger = logging.getLogger(__name__)
+
+XSSI_PREFIX = b")]}'\n"
+GERRIT_DATE = "2020-07-01 10:00:00.000000000"
+
+
+def fake_sha(*parts):
+    return hashlib.sha1("/".join(str(p) for p in parts).encode()).hexdigest()
+
+
+def fake_commit(sha, message, parents=()):
+    person = {
+        "name": "Jan Kowalski",
+        "email": "jan.kowalski@pekao.com.pl",
+        "date": GERRIT_DATE,
+        "tz": 60,
+    }
+    return {
+        "commit": sha,
+        "parents": [{"commit": p, "subject": "parent"} for p in parents],
+        "author": person,
+        "committer": person,
+        "subject": message.splitlines()[0],
+        "message": message,
+        "web_links": [{"name": "browse", "url": f"/plugins/gitiles/+/{sha}"}],
+    }
+
+
+class FakeGerrit:
+    """Minimal Gerrit REST API served as ASGI application
+
+    Use with `httpx.AsyncClient(app=FakeGerrit())`. Every request path is
+    recorded in `requests`, so tests can count round-trips.
+    """
+
+    routes = (
+        ("changes_query", re.compile(r"^/a/changes/$")),
+        ("mergelist", re.compile(r"^/a/changes/([^/]+)/revisions/([^/]+)/mergelist$")),
+        ("change", re.compile(r"^/a/changes/([^/]+)$")),
+        ("projects", re.compile(r"^/a/projects/$")),
+        ("commit_in", re.compile(r"^/a/projects/([^/]+)/commits/([^/]+)/in$")),
+        ("commit", re.compile(r"^/a/projects/([^/]+)/commits/([^/]+)$")),
+        ("project", re.compile(r"^/a/projects/([^/]+)$")),
+    )
+
+    def __init__(self):
+        self.changes = {}
+        # changes by SHA of current revision, found only by commit:SHA query
+        self.revisions = {}
+        self.mergelists = {}
+        self.commits = {}
+        self.branches = {}
+        self.projects = {}
+        self.requests = []
+        # statuses returned instead of responses to next requests
+        self.failures = []
+
+    async def __call__(self, scope, receive, send):
+        path = scope["path"]
+        query = parse_qs(scope["query_string"].decode())
+        self.requests.append(path)
+        logger.debug("GET %s %s", path, query)
+        if self.failures:
+            status, data = self.failures.pop(0), "Service Unavailable"
+        else:
+            status, data = self.dispatch(path, query)
+        body = json.dumps(data).encode() if status == 200 else data.encode()
+        headers = [(b"content-type", b"application/json")]
+        if status == 200:
+            body = XSSI_PREFIX + body
+        elif status in (429, 503):
+            headers.append((b"retry-after", b"0"))
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": headers,
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    def dispatch(self, path, query):
+        for name, route in self.routes:
+            match = route.match(path)
+            if match:
+                args = [unquote(arg) for arg in match.groups()]
+                return getattr(self, f"get_{name}")(query, *args)
+        return (404, "Not found")
+
+    def get_change(self, query, change_id):
+        try:
+            return (200, self.changes[change_id])
+        except KeyError:
+            return (404, "Not found")
+
+    def get_changes_query(self, query, *args):
+        # every `q` is single "change:REF" or "commit:SHA" query
+        results = []
+        for q in query.get("q", ()):
+            operator, _, ref = q.partition(":")
+            index = self.revisions if operator == "commit" else self.changes
+            change = index.get(ref)
+            results.append([] if change is None else [change])
+        if len(results) == 1:
+            return (200, results[0])
+        return (200, results)
+
+    def get_mergelist(self, query, change_id, revision):
+        try:
+            return (200, self.mergelists[change_id])
+        except KeyError:
+            return (404, "Not found")
+
+    def get_commit(self, query, project, sha):
+        try:
+            return (200, self.commits[(project, sha)])
+        except KeyError:
+            return (404, "Not found")
+
+    def get_commit_in(self, query, project, sha):
+        if (project, sha) not in self.commits:
+            return (404, "Not found")
+        branches = sorted(self.branches.get(sha, ()))
+        return (200, {"branches": branches, "tags": []})
+
+    def get_project(self, query, name):
+        try:
+            return (200, self.projects[name])
+        except KeyError:
+            return (404, "Not found")
+
+    def get_projects(self, query, *args):
+        names = sorted(self.projects)
+        prefix = query.get("p", [""])[0]
+        names = [name for name in names if name.startswith(prefix)]
+        start = int(query.get("S", ["0"])[0])
+        limit = int(query.get("n", ["0"])[0]) or len(names)
+        page = names[start : start + limit]
+        data = {name: dict(self.projects[name]) for name in page}
+        if page and start + limit < len(names):
+            data[page[-1]]["_more_projects"] = True
+        return (200, data)
+
+    def fake_project(self, name):
+        item = {"id": name.replace("/", "%2F"), "name": name, "state": "ACTIVE"}
+        self.projects[name] = item
+        return item
+
+    def fake_commit(self, project, message, parents=(), branches=("develop",)):
+        sha = fake_sha(project, message, *parents)
+        commit = fake_commit(sha, message, parents)
+        self.commits[(project, sha)] = commit
+        self.branches[sha] = set(branches)
+        return commit
+
+    def fake_change(
+        self,
+        number,
+        message,
+        project="infra/skylla",
+        branch="develop",
+        parents=None,
+        mergelist=None,
+        sha=None,
+        status="MERGED",
+        patchset=1,
+    ):
+        """Registers a change (merged by default) with its current patchset
+
+        If `mergelist` (list of commit messages) is given the change is
+        a merge commit, and the mergelist endpoint will return those commits.
+        Registering the same number again replaces the current patchset.
+        """
+        if patchset == 1:
+            sha = sha or fake_sha(project, number)
+        else:
+            sha = sha or fake_sha(project, number, patchset)
+        if parents is None:
+            parents = [fake_sha(project, number, "parent")]
+            if mergelist is not None:
+                parents.append(fake_sha(project, number, "merged"))
+        commit = fake_commit(sha, message, parents)
+        change_id = f"I{fake_sha('change', number)}"
+        change = {
+            "id": f"{project.replace('/', '%2F')}~{branch}~{change_id}",
+            "project": project,
+            "branch": branch,
+            "change_id": change_id,
+            "subject": commit["subject"],
+            "status": status,
+            "created": GERRIT_DATE,
+            "updated": GERRIT_DATE,
+            "insertions": 1,
+            "deletions": 0,
+            "_number": number,
+            "owner": {"_account_id": 1000},
+            "current_revision": sha,
+            "revisions": {
+                sha: {
+                    "kind": "REWORK",
+                    "_number": patchset,
+                    "created": GERRIT_DATE,
+                    "uploader": {"_account_id": 1000},
+                    "ref": f"refs/changes/{number % 100:02}/{number}/{patchset}",
+                    "fetch": {},
+                    "commit": commit,
+                }
+            },
+        }
+        # Gerrit does not accept commit SHA as change identifier
+        for key in (str(number), change_id):
+            self.changes[key] = change
+        self.revisions[sha] = change
+        self.commits[(project, sha)] = commit
+        self.branches[sha] = {branch}
+        if mergelist is not None:
+            merged = [
+                fake_commit(fake_sha(project, number, i), msg, parents=[parents[0]])
+                for i, msg in enumerate(mergelist)
+            ]
+            for key in (str(number), change_id):
+                self.mergelists[key] = merged
+        return change
+
+
+def get_fake_gerrit_client(fake=None):
+    import httpx
+
+    from skylla.clients.gerrit import GerritClient
+
+    fake = fake or FakeGerrit()
+    ger = GerritClient(httpx.AsyncClient(app=fake))
+    # httpx refuses "https+mock" scheme used in test config
+    ger.base_addr = "https://gerrit/a"
+    ger.fake = fake
+    return ger
@@ -3,7 +3,7 @@ import json
 import logging
 import os
 import re
-from urllib.parse import urlparse
+from urllib.parse import parse_qs, urlparse
 
 import jira
 import pytz
@@ -43,6 +43,8 @@ class FakeJiraAdapter(requests.adapters.BaseAdapter):
         self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None
     ):
         response = requests.models.Response()
+        response.request = request
+        response.url = request.url
         logger.debug("%s %s", request.method, request.path_url)
         try:
             method = getattr(self, f"handle_{request.method.lower()}")
@@ -52,6 +54,9 @@ class FakeJiraAdapter(requests.adapters.BaseAdapter):
             return response
         request.urlobj = urlparse(request.url)
         request.jira_path = self.re_api_prefix.sub("", request.urlobj.path)
+        self.jira_data.setdefault("_requests", []).append(
+            (request.method, request.jira_path)
+        )
         status_code, content = method(request)
         response.status_code = status_code
         response._content = content.encode("utf-8")
@@ -68,7 +73,36 @@ class FakeJiraAdapter(requests.adapters.BaseAdapter):
             return (404, f"Not Found: {issue}/{resource}")
         return (200, json.dumps(res))
 
+    def search(self, request):
+        query = parse_qs(request.urlobj.query)
+        jql = query["jql"][0]
+        m = re.match(r"key in \((.*)\)", jql)
+        if not m:
+            return (400, json.dumps({"errorMessages": [f"Unsupported JQL: {jql}"]}))
+        keys = re.findall(r'"([^"]+)"', m.group(1))
+        issues = []
+        errors = []
+        for key in keys:
+            try:
+                issues.append(self.jira_data.path_get(f"issue/{key}"))
+            except KeyError:
+                errors.append(
+                    f"An issue with key '{key}' does not exist for field 'key'."
+                )
+        if errors:
+            return (400, json.dumps({"errorMessages": errors, "errors": {}}))
+        self.jira_data.setdefault("_searches", []).append(keys)
+        data = {"startAt": 0, "maxResults": 50, "total": len(issues), "issues": issues}
+        return (200, json.dumps(data))
+
     def handle_get(self, request):
+        if request.jira_path == "search":
+            return self.search(request)
+        if request.jira_path == "project" and "project" not in self.jira_data:
+            return (200, "[]")
+        if (m := re.match("project/(.*)/components", request.jira_path)) :
+            data = self.jira_data.get("_components", {}).get(m.group(1), [])
+            return (200, json.dumps(data))
         if re.match("issue/.*/transitions", request.jira_path):
             data = self.jira_data.path_get("_methods/REL/transitions")
             return (200, json.dumps(data))
@@ -121,7 +155,10 @@ class FakeJiraAdapter(requests.adapters.BaseAdapter):
     def transition_issue(self, issue, request):
         trans = self.jira_data.path_get("_methods/REL/transitions")["transitions"]
         indata = json.loads(request.body)
-        selected = list(dict_select(trans, indata["transition"]))
+        select = dict(indata["transition"])
+        if "id" in select:
+            select["id"] = str(select["id"])
+        selected = list(dict_select(trans, select))
         if not selected:
             return (400, "No transition")
         assert len(selected) == 1
@@ -182,6 +219,17 @@ class FakeJira(jira.JIRA):
         self.data.new_element("project", item, key="key")
         return item
 
+    def fake_component(self, project_key, name):
+        components = self.data.setdefault("_components", {}).setdefault(project_key, [])
+        item = {
+            "id": str(10_000 + len(components)),
+            "self": jurl(f"component/{10_000 + len(components)}"),
+            "name": name,
+            "project": project_key,
+        }
+        components.append(item)
+        return item
+
     def fake_issue(
         self,
         key,
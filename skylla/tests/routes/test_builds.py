@@ -0,0 +1,214 @@
+import json
+
+import pytest
+
+from tests.mocks.gerrit.fake import get_fake_gerrit_client
+from tests.mocks.jira.fake import get_fake_jira_client
+
+
+def build_info(ref, **kw):
+    from skylla.models.builds import BuildInfo
+
+    data = {
+        "id": "1",
+        "version": "1.0.0",
+        "ref": ref,
+        "repo": "https://gerrit/a/infra/skylla",
+        "url": "https://jenkins/job/skylla/1",
+        "start": "2020-07-01T10:00:00",
+        "end": "2020-07-01T10:05:00",
+    }
+    data.update(kw)
+    return BuildInfo.parse_obj(data)
+
+
+@pytest.mark.asyncio
+async def test_build_completed():
+    from skylla.routes.builds import process_build_completed
+
+    ger = get_fake_gerrit_client()
+    ger.fake.fake_change(1234, "REL-900 poprawka\n\nABC-1 i UTF-8")
+    fj = get_fake_jira_client()
+    fj.fake_issue("REL-900", assignee="jira_tech_gerrit")
+
+    await process_build_completed(build_info("1234"), ger=ger, jira=fj)
+
+    rel900 = fj.issue("REL-900")
+    assert "1234/1" in rel900.fields.comment.comments[0].body
+    assert rel900.fields.status.name == "Gotowe"
+    assert [c.name for c in rel900.fields.components] == ["infra/skylla"]
+
+
+@pytest.mark.asyncio
+async def test_build_completed_other_branch():
+    from skylla.routes.builds import process_build_completed
+
+    ger = get_fake_gerrit_client()
+    ger.fake.fake_change(1234, "REL-900 poprawka", branch="master")
+    fj = get_fake_jira_client()
+    fj.fake_issue("REL-900")
+
+    await process_build_completed(build_info("1234"), ger=ger, jira=fj)
+
+    assert not fj.issue("REL-900").fields.comment.comments
+
+
+@pytest.mark.asyncio
+async def test_build_completed_batch():
+    from skylla.models.builds import BuildBatch
+    from skylla.routes.builds import process_build_batch
+
+    ger = get_fake_gerrit_client()
+    ger.fake.fake_change(1234, "REL-900 poprawka")
+    ger.fake.fake_change(1235, "REL-900 REL-901 kolejna poprawka")
+    fj = get_fake_jira_client()
+    fj.fake_issue("REL-900", assignee="jira_tech_gerrit")
+    fj.fake_issue("REL-901", assignee="jira_tech_gerrit")
+    batch = BuildBatch(
+        builds=[
+            build_info("1234", id="1", url="https://jenkins/job/skylla-a/1"),
+            build_info("1234", id="2", url="https://jenkins/job/skylla-b/1"),
+            build_info("1235", id="3", url="https://jenkins/job/skylla-a/2"),
+        ]
+    )
+
+    await process_build_batch(batch, ger=ger, jira=fj)
+
+    comments = fj.issue("REL-900").fields.comment.comments
+    assert len(comments) == 1
+    lines = comments[0].body.splitlines()
+    assert len(lines) == 3
+    assert "skylla-b/1" in lines[1] and "1235/1" in lines[2]
+    assert len(fj.issue("REL-901").fields.comment.comments) == 1
+    assert fj.issue("REL-901").fields.status.name == "Gotowe"
+    # change with its commit fetched in one request, despite two builds of 1234
+    assert ger.fake.requests.count("/a/changes/1234") == 1
+
+
+@pytest.mark.asyncio
+async def test_batch_and_single_build_coalesced():
+    from skylla.lib.coalesce import CommentCoalescer
+    from skylla.models.builds import BuildBatch
+    from skylla.routes.builds import process_build_batch, process_build_completed
+
+    ger = get_fake_gerrit_client()
+    ger.fake.fake_change(1234, "REL-900 poprawka")
+    ger.fake.fake_change(1235, "REL-900 kolejna poprawka")
+    fj = get_fake_jira_client()
+    fj.fake_issue("REL-900", assignee="jira_tech_gerrit")
+    fj._coalescer = CommentCoalescer(fj.issues_ready_each, 60)
+    batch = BuildBatch(builds=[build_info("1235", id="2")])
+
+    await process_build_completed(build_info("1234", id="1"), ger=ger, jira=fj)
+    await process_build_batch(batch, ger=ger, jira=fj)
+    await fj.coalescer.close()
+
+    rel900 = fj.issue("REL-900")
+    comments = rel900.fields.comment.comments
+    assert len(comments) == 1
+    assert "1234/1" in comments[0].body and "1235/1" in comments[0].body
+    assert [c.name for c in rel900.fields.components] == ["infra/skylla"]
+
+
+@pytest.mark.asyncio
+async def test_repeated_deployment_uses_key_index():
+    from skylla.models.builds import PatchInfo
+    from skylla.routes.builds import process_build_patched
+
+    ger = get_fake_gerrit_client()
+    ger.fake.fake_change(1236, "REL-902 poprawka")
+    fj = get_fake_jira_client()
+    fj.fake_issue("REL-902", assignee="jira_tech_gerrit")
+    patch = {
+        "id": "1",
+        "version": "1.0.0",
+        "ref": "1236",
+        "repo": "https://gerrit/a/infra/skylla",
+        "start": "2020-07-01T10:00:00",
+        "end": "2020-07-01T10:05:00",
+    }
+
+    await process_build_patched(
+        PatchInfo(environment="PRE", **patch), ger=ger, jira=fj
+    )
+    fetched = len(ger.fake.requests)
+    await process_build_patched(
+        PatchInfo(environment="PROD", **patch), ger=ger, jira=fj
+    )
+
+    assert len(ger.fake.requests) == fetched
+    comments = fj.issue("REL-902").fields.comment.comments
+    assert [c.body for c in comments] == [
+        "wdrożone na $PreProdukcyjne",
+        "wdrożone na $Produkcyjne",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_repeated_build_uses_key_index():
+    from skylla.routes.builds import process_build_completed
+
+    ger = get_fake_gerrit_client()
+    ger.fake.fake_change(1237, "REL-903 poprawka", mergelist=["REL-904 zmiana"])
+    fj = get_fake_jira_client()
+    fj.fake_issue("REL-904", assignee="jira_tech_gerrit")
+
+    await process_build_completed(build_info("1237"), ger=ger, jira=fj)
+    fetched = len(ger.fake.requests)
+    await process_build_completed(build_info("1237", id="2"), ger=ger, jira=fj)
+
+    # change for the comment is in the response cache, mergelist is not needed
+    assert len(ger.fake.requests) == fetched
+    assert len(fj.issue("REL-904").fields.comment.comments) == 2
+
+
+@pytest.mark.asyncio
+async def test_new_patchset_not_taken_from_key_index():
+    from skylla.routes.builds import process_build_completed
+
+    ger = get_fake_gerrit_client()
+    ger.fake.fake_change(1238, "REL-905 poprawka", status="NEW")
+    fj = get_fake_jira_client()
+    fj.fake_issue("REL-905", assignee="jira_tech_gerrit")
+    fj.fake_issue("REL-906", assignee="jira_tech_gerrit")
+
+    await process_build_completed(build_info("1238"), ger=ger, jira=fj)
+    ger.fake.fake_change(1238, "REL-906 poprawka", status="NEW", patchset=2)
+    ger.cache.clear()
+    await process_build_completed(build_info("1238", id="2"), ger=ger, jira=fj)
+
+    assert len(fj.issue("REL-905").fields.comment.comments) == 1
+    assert len(fj.issue("REL-906").fields.comment.comments) == 1
+
+
+def test_http_contract():
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from skylla.lib.jobs import JobQueue, get_job_queue
+    from skylla.lib.jobstore import JobStore
+    from skylla.models.builds import BuildInfo
+    from skylla.routes.builds import router
+
+    # no workers, accepted job stays queued and fills the queue
+    jobs = JobQueue(
+        workers=0, max_depth=1, keep_finished=10, store=JobStore(":memory:")
+    )
+    jobs.handler("build_completed", BuildInfo)(None)
+    app = FastAPI(on_startup=[jobs.start], on_shutdown=[jobs.stop])
+    app.include_router(router, prefix="/build")
+    app.dependency_overrides[get_job_queue] = lambda: jobs
+    body = json.loads(build_info("1234").json())
+
+    with TestClient(app) as client:
+        resp = client.post("/build/completed", json=body)
+        assert resp.status_code == 202
+        job = resp.json()
+        assert job["id"] and job["state"] == "queued"
+        status = client.get(f"/build/jobs/{job['id']}")
+        assert status.status_code == 200 and status.json()["id"] == job["id"]
+
+        resp = client.post("/build/completed", json=dict(body, id="2"))
+        assert resp.status_code == 503
+
+        assert client.get("/build/jobs/unknown").status_code == 404